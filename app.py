@@ -8,6 +8,9 @@ import json
 import time
 import hashlib
 import secrets
+import threading
+import itertools
+from collections import OrderedDict
 from functools import wraps
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta
@@ -17,6 +20,7 @@ from flask_limiter.util import get_remote_address
 from prometheus_flask_exporter import PrometheusMetrics
 
 
+
 app = Flask(__name__)
 
 # CSRF Protection
@@ -46,6 +50,10 @@ orders_pending = Gauge('pos_orders_pending', 'Number of pending orders', ['type'
 
 app.secret_key = os.environ.get("FLASK_SECRET_KEY", "dev-secret-key-change-in-production")
 
+# Compiled templates are cached per process; only check template files for
+# changes (a stat per render) when developing with FLASK_DEBUG
+app.config['TEMPLATES_AUTO_RELOAD'] = os.environ.get("FLASK_DEBUG", "false").lower() == "true"
+
 
 # Standardized API response helpers (REF-004)
 def api_success(message: str = "Success", data: dict | list | None = None, status_code: int = 200) -> tuple:
@@ -81,7 +89,9 @@ def api_error(message: str, status_code: int = 400, error_code: str | None = Non
         response["error_code"] = error_code
     return jsonify(response), status_code
 
+
 # Register Roast Tracker Blueprint
+from roast_tracker.json_utils import json_bytes, jsonify_fast
 from roast_tracker.routes import roast_tracker
 app.register_blueprint(roast_tracker)
 
@@ -134,8 +144,31 @@ logging.info(f"Billingo environment: {BILLINGO_ENV}, Receipt Block: {BILLINGO_RE
 logging.info(f"Using database: {DATABASE}")
 
 # In-memory storage for active sales per user (for customer display)
-# Format: { 'username': { 'items': [...], 'total': 0, 'updated_at': timestamp } }
-active_sales = {}
+# Format: { 'username': { 'items': [...], 'total': 0, 'rev': int, 'updated_at': timestamp } }
+# 'rev' comes from a process-wide counter and drives SSE change detection;
+# 'updated_at' is wall-clock time, only used for TTL expiry
+# Bounded: least recently updated users are evicted past ACTIVE_SALES_MAX_USERS,
+# and entries untouched for ACTIVE_SALES_TTL_SECONDS are dropped
+ACTIVE_SALES_MAX_USERS = 1000
+ACTIVE_SALES_TTL_SECONDS = 24 * 60 * 60
+active_sales = OrderedDict()
+active_sales_lock = threading.Lock()
+_sale_revision = itertools.count(1)
+
+
+def store_active_sale(username: str, sale_data: dict) -> None:
+    """Store a user's current sale, evicting expired and excess entries."""
+    with active_sales_lock:
+        active_sales[username] = sale_data
+        active_sales.move_to_end(username)
+
+        cutoff = time.time() - ACTIVE_SALES_TTL_SECONDS
+        while active_sales:
+            oldest_sale = next(iter(active_sales.values()))
+            if len(active_sales) > ACTIVE_SALES_MAX_USERS or oldest_sale.get('updated_at', 0) < cutoff:
+                active_sales.popitem(last=False)
+            else:
+                break
 
 # Database helper functions
 def query_db(query: str, args: tuple = (), one: bool = False) -> list | sqlite3.Row | None:
@@ -1575,14 +1608,14 @@ def get_active_market_session():
 
 def get_packaged_products():
     """Get packaged products from roast_tracker.db for market preparation"""
-    from roast_tracker.database import get_db as get_roast_db
+    from roast_tracker.database import get_db as get_roast_db, PACKED_TYPES_SQL
 
     conn = get_roast_db()
     cur = conn.cursor()
 
     # Query production batches with product info
     # Only get whole_bean packages (marketable sizes)
-    cur.execute("""
+    cur.execute(f"""
         SELECT
             pb.id as production_batch_id,
             pb.production_lot,
@@ -1600,7 +1633,7 @@ def get_packaged_products():
         JOIN roast_batches rb ON ps.roast_batch_id = rb.id
         JOIN coffee_products cp ON rb.product_id = cp.id
         LEFT JOIN green_coffee gc ON cp.green_coffee_id = gc.id
-        WHERE pb.production_type IN ('whole_bean_250', 'whole_bean_70', 'whole_bean_16', 'drip_11')
+        WHERE pb.production_type IN ({PACKED_TYPES_SQL})
         ORDER BY pb.production_date DESC, cp.name
     """)
 
@@ -2270,15 +2303,16 @@ def update_sale():
         discount = data.get('discount', 0)
         status = data.get('status', 'active')  # 'active', 'completed', 'cleared'
 
-        active_sales[username] = {
+        store_active_sale(username, {
             'items': items,
             'total': total,
             'discount': discount,
             'status': status,
+            'rev': next(_sale_revision),
             'updated_at': time.time()
-        }
+        })
 
-        return jsonify({"status": "success"})
+        return jsonify_fast({"status": "success"})
     except Exception as e:
         logging.error(f"Error updating sale: {e}")
         return jsonify({"status": "error", "message": str(e)}), 500
@@ -2296,14 +2330,19 @@ def get_sale():
         'total': 0,
         'discount': 0,
         'status': 'empty',
+        'rev': 0,
         'updated_at': 0
     })
 
-    return jsonify({
+    return jsonify_fast({
         "status": "success",
         "data": sale_data
     })
 
+# Fixed parts of an SSE frame, prebuilt so each update is one bytes join
+SSE_DATA_PREFIX = b"data: "
+SSE_FRAME_END = b"\n\n"
+
 @app.route('/api/sale_stream')
 @login_required
 def sale_stream():
@@ -2313,20 +2352,31 @@ def sale_stream():
         return jsonify({"status": "error", "message": "Not logged in"}), 401
 
     def generate():
-        last_update = 0
+        last_rev = 0
         while True:
             sale_data = active_sales.get(username, {
                 'items': [],
                 'total': 0,
                 'discount': 0,
                 'status': 'empty',
+                'rev': 0,
                 'updated_at': 0
             })
 
-            # Only send if there's a new update
-            if sale_data.get('updated_at', 0) > last_update:
-                last_update = sale_data.get('updated_at', 0)
-                yield f"data: {json.dumps(sale_data)}\n\n"
+            # Only send if there's a new update (rev is immune to wall-clock jumps)
+            rev = sale_data.get('rev', 0)
+            if rev > last_rev:
+                last_rev = rev
+                yield SSE_DATA_PREFIX + json_bytes(sale_data) + SSE_FRAME_END
+
+            # Drop a finished sale nobody has touched for a day; the display reconnects
+            if (sale_data.get('status') in ('cleared', 'empty')
+                    and last_rev
+                    and time.time() - sale_data.get('updated_at', 0) > ACTIVE_SALES_TTL_SECONDS):
+                with active_sales_lock:
+                    if active_sales.get(username) is sale_data:
+                        del active_sales[username]
+                break
 
             time.sleep(0.5)  # Check every 500ms
 
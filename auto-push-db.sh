@@ -6,6 +6,13 @@ cd /home/brenesamerica/POS
 # Database files to track
 DB_FILES="pos_test.db pos_prod.db roast_tracker_test.db roast_tracker_prod.db"
 
+# Fold WAL journals back into the main database files before checking for changes
+for db in $DB_FILES; do
+    if [ -f "$db-wal" ]; then
+        python3 -c "import sqlite3, sys; sqlite3.connect(sys.argv[1]).execute('PRAGMA wal_checkpoint(TRUNCATE)')" "$db"
+    fi
+done
+
 # Check if there are changes to any database files
 CHANGES=0
 for db in $DB_FILES; do
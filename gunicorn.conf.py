@@ -0,0 +1,31 @@
+"""
+Gunicorn configuration for the POS app
+
+Gunicorn picks this file up automatically when started from the project
+directory (see the systemd service files). The bind address stays on the
+command line so prod (5000) and test (5001) can share this config.
+
+The customer display keeps a Server-Sent Events connection open for the whole
+page lifetime (/api/sale_stream), so each display pins one worker thread.
+The threaded worker lets many idle SSE clients coexist with normal requests.
+
+To use gevent instead: pip install gevent and set GUNICORN_WORKER_CLASS=gevent.
+Gunicorn's gevent worker monkey-patches the stdlib itself, so the
+time.sleep() in the SSE generator yields cooperatively.
+"""
+import os
+
+# Threaded workers so long-lived SSE streams don't block other requests
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.environ.get("GUNICORN_THREADS", "64"))
+
+# Single worker process: active_sales (customer display state) lives in
+# process memory, so update_sale and sale_stream must hit the same process
+workers = int(os.environ.get("GUNICORN_WORKERS", "1"))
+
+# Only used by async workers (gevent/eventlet)
+worker_connections = 1000
+
+keepalive = 30
+timeout = 120
+
@@ -38,6 +38,12 @@ echo "[4/7] Creating Python virtual environment..."
 python3 -m venv venv
 source venv/bin/activate
 
+# The roast tracker's SQL needs SQLite 3.35+ (see roast_tracker/database.py)
+python3 -c "import sqlite3, sys; sys.exit(sqlite3.sqlite_version_info < (3, 35, 0))" || {
+    echo "ERROR: SQLite 3.35 or newer is required (found $(python3 -c 'import sqlite3; print(sqlite3.sqlite_version)'))"
+    exit 1
+}
+
 # Install Python dependencies
 echo "[5/7] Installing Python dependencies..."
 pip install --upgrade pip
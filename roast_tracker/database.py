@@ -5,6 +5,12 @@ import sqlite3
 import os
 import logging
 import shutil
+import threading
+
+# Oldest SQLite library the roast tracker's SQL runs on: UPDATE/INSERT ...
+# RETURNING needs 3.35; UPDATE ... FROM (3.33), upserts (3.24) and window
+# functions (3.25) come earlier. Checked once by init_db at startup.
+MIN_SQLITE_VERSION = (3, 35, 0)
 
 # Use environment variable to determine test vs prod database
 BILLINGO_ENV = os.environ.get("BILLINGO_ENV", "test")  # Default to test for safety
@@ -21,28 +27,225 @@ if not os.path.exists(DATABASE_PATH) and os.path.exists(OLD_DATABASE_PATH):
 logging.info(f"Roast Tracker using database: {DATABASE_NAME}")
 
 
-def get_db():
-    """Get database connection"""
-    conn = sqlite3.connect(DATABASE_PATH)
+# Applied to every new connection; WAL lets readers run alongside a writer
+CONNECTION_PRAGMAS = """
+    PRAGMA journal_mode=WAL;
+    PRAGMA synchronous=NORMAL;
+    PRAGMA temp_store=MEMORY;
+    PRAGMA mmap_size=268435456;
+    PRAGMA cache_size=-65536;
+"""
+
+# One long-lived connection per thread, shared by query_db and get_db
+_thread_local = threading.local()
+
+
+def _connect():
+    """Open a connection with the Row factory and CONNECTION_PRAGMAS applied"""
+    conn = sqlite3.connect(DATABASE_PATH, cached_statements=256)
     conn.row_factory = sqlite3.Row
+    conn.executescript(CONNECTION_PRAGMAS)
     return conn
 
 
+def get_thread_db():
+    """Get this thread's persistent database connection (do not close it)"""
+    conn = getattr(_thread_local, 'conn', None)
+    if conn is None:
+        conn = _connect()
+        _thread_local.conn = conn
+    return conn
+
+
+class _BorrowedConnection:
+    """The thread's connection as handed out by get_db()
+
+    Behaves like the sqlite3 connection, except that close() only rolls back
+    an unfinished transaction (what closing used to do), so the connection,
+    its page cache and statement cache are reused by the next request.
+    """
+    __slots__ = ('_conn',)
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        if self._conn.in_transaction:
+            self._conn.rollback()
+
+
+def get_db():
+    """Get a database connection for writes (caller commits and closes it)"""
+    return _BorrowedConnection(get_thread_db())
+
+
+def release_thread_db():
+    """Roll back anything a request left uncommitted on this thread's connection"""
+    conn = getattr(_thread_local, 'conn', None)
+    if conn is not None and conn.in_transaction:
+        conn.rollback()
+
+
+# Process-wide counter of observed database changes (see change_serial)
+_change_serial = 0
+_change_serial_lock = threading.Lock()
+
+
+def change_serial():
+    """
+    Number that changes whenever the database may have changed.
+
+    Each thread's connection remembers the PRAGMA data_version (which moves
+    when any other connection or process commits) and its own total_changes
+    it saw last; when either differs, the shared serial is advanced. Every
+    write to any table counts, so results keyed on it can't go stale.
+    """
+    global _change_serial
+    conn = get_thread_db()
+    seen = (conn.execute("PRAGMA data_version").fetchone()[0], conn.total_changes)
+    if getattr(_thread_local, 'seen_version', None) != seen:
+        with _change_serial_lock:
+            _thread_local.seen_version = seen
+            _change_serial += 1
+    return _change_serial
+
+
 def query_db(query, args=(), one=False):
     """Execute a query and return results"""
-    conn = get_db()
-    cur = conn.execute(query, args)
-    rv = cur.fetchall()
-    conn.commit()
-    conn.close()
+    conn = get_thread_db()
+    # Inside a caller's open transaction, leave committing to the caller
+    owns_transaction = not conn.in_transaction
+    try:
+        cur = conn.execute(query, args)
+        rv = cur.fetchall()
+        # Only writes open a transaction; plain SELECTs skip the commit
+        if owns_transaction and conn.in_transaction:
+            conn.commit()
+    except Exception:
+        if owns_transaction and conn.in_transaction:
+            conn.rollback()
+        raise
     return (rv[0] if rv else None) if one else rv
 
 
+def query_scalar(query, args=()):
+    """Execute a query and return the first column of the first row (or None)"""
+    conn = get_thread_db()
+    owns_transaction = not conn.in_transaction
+    try:
+        row = conn.execute(query, args).fetchone()
+        if owns_transaction and conn.in_transaction:
+            conn.commit()
+    except Exception:
+        if owns_transaction and conn.in_transaction:
+            conn.rollback()
+        raise
+    return row[0] if row else None
+
+
+def query_many(*queries):
+    """
+    Run several SELECTs on one cursor inside a single read transaction.
+
+    Each query is either a SQL string or a (sql, args) tuple. All results
+    come from the same snapshot; returns one row list per query. A
+    transaction the caller already has open is joined and left open.
+    """
+    conn = get_thread_db()
+    cur = conn.cursor()
+    owns_transaction = not conn.in_transaction
+    if owns_transaction:
+        cur.execute("BEGIN")
+    try:
+        results = []
+        for query in queries:
+            sql, args = (query, ()) if isinstance(query, str) else query
+            cur.execute(sql, args)
+            results.append(cur.fetchall())
+    except Exception:
+        if owns_transaction and conn.in_transaction:
+            conn.rollback()
+        raise
+    if owns_transaction:
+        conn.commit()
+    return results
+
+
+# Shippable package types counted as packed stock
+PACKED_PRODUCTION_TYPES = ('whole_bean_250', 'whole_bean_70', 'whole_bean_16', 'drip_11')
+# ...as an SQL IN-list body, built once so every query embedding it has the
+# same statement text (and stays in the connection's statement cache)
+PACKED_TYPES_SQL = ', '.join(f"'{t}'" for t in PACKED_PRODUCTION_TYPES)
+
+# production_sources columns. Not STRICT: the .db files are shared between
+# hosts, and SQLite older than 3.37 can't open a database with STRICT tables.
+_PRODUCTION_SOURCES_SCHEMA = """(
+            production_batch_id INTEGER NOT NULL,
+            roast_batch_id INTEGER NOT NULL,
+            weight_used_g REAL NOT NULL,
+            PRIMARY KEY (production_batch_id, roast_batch_id),
+            FOREIGN KEY (production_batch_id) REFERENCES production_batches(id),
+            FOREIGN KEY (roast_batch_id) REFERENCES roast_batches(id)
+        ) WITHOUT ROWID"""
+
+STOCK_TRIGGERS = (
+    'trg_roast_batches_stock_insert', 'trg_roast_batches_stock_update',
+    'trg_roast_batches_stock_delete', 'trg_roast_batches_packed_move',
+    'trg_production_sources_stock_insert', 'trg_production_sources_stock_update',
+    'trg_production_sources_stock_delete', 'trg_production_batches_stock_update',
+    'trg_production_batches_stock_delete',
+)
+
+
+def _packed_g(pb):
+    """SQL: packed stock weight of production batch row `pb` (0 if not shippable)"""
+    return (f"(CASE WHEN {pb}.quantity > 0 AND {pb}.production_type IN ({PACKED_TYPES_SQL}) "
+            f"THEN {pb}.quantity * COALESCE({pb}.package_size_g, 0) ELSE 0 END)")
+
+
+def _packed_for_source(ps):
+    """SQL: packed weight contributed by production_sources row `ps`"""
+    return (f"COALESCE((SELECT {_packed_g('pb')} FROM production_batches pb "
+            f"WHERE pb.id = {ps}.production_batch_id), 0)")
+
+
+def _packed_from_roast_batch(rb):
+    """SQL: packed weight of all packages sourced from roast_batches row `rb`"""
+    return (f"(SELECT TOTAL({_packed_g('pb')}) FROM production_sources ps "
+            f"JOIN production_batches pb ON ps.production_batch_id = pb.id "
+            f"WHERE ps.roast_batch_id = {rb}.id)")
+
+
+def _source_products(pb):
+    """SQL: products the production batch row `pb` was sourced from"""
+    return (f"SELECT rb.product_id FROM production_sources ps "
+            f"JOIN roast_batches rb ON ps.roast_batch_id = rb.id "
+            f"WHERE ps.production_batch_id = {pb}.id")
+
+
+def _sources_of_product(pb):
+    """SQL: number of sources of production batch row `pb` from the product_stock row's product"""
+    return (f"(SELECT COUNT(*) FROM production_sources ps "
+            f"JOIN roast_batches rb ON ps.roast_batch_id = rb.id "
+            f"WHERE ps.production_batch_id = {pb}.id AND rb.product_id = product_stock.product_id)")
+
+
 def init_db():
     """Initialize the database with schema"""
+    if sqlite3.sqlite_version_info < MIN_SQLITE_VERSION:
+        raise RuntimeError(
+            f"Roast Tracker needs SQLite {'.'.join(map(str, MIN_SQLITE_VERSION))} or newer, "
+            f"but Python's sqlite3 module uses {sqlite3.sqlite_version}")
+
     conn = get_db()
     cur = conn.cursor()
 
+    # Run all DDL and migrations in one transaction (one sync instead of one per statement)
+    cur.execute("BEGIN")
+
     # Green coffee (raw materials)
     cur.execute("""
         CREATE TABLE IF NOT EXISTS green_coffee (
@@ -143,16 +346,44 @@ def init_db():
     """)
 
     # Links production batches to source roast batches (many-to-many)
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS production_sources (
-            id INTEGER PRIMARY KEY,
-            production_batch_id INTEGER NOT NULL,
-            roast_batch_id INTEGER NOT NULL,
-            weight_used_g REAL NOT NULL,
-            FOREIGN KEY (production_batch_id) REFERENCES production_batches(id),
-            FOREIGN KEY (roast_batch_id) REFERENCES roast_batches(id)
-        )
-    """)
+    cur.execute(f"CREATE TABLE IF NOT EXISTS production_sources {_PRODUCTION_SOURCES_SCHEMA}")
+
+    # Migration: production_sources used to be a rowid table with a surrogate id.
+    # Rebuild it keyed on the link itself so joins by production batch read the
+    # table B-tree directly (an early version of this migration also made it
+    # STRICT, which is undone the same way). The stock triggers reference it
+    # and are recreated below.
+    ps_sql = cur.execute("""
+        SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'production_sources'
+    """).fetchone()[0]
+    if 'WITHOUT ROWID' not in ps_sql or 'STRICT' in ps_sql:
+        # The new key allows one row per (production batch, roast batch);
+        # don't merge duplicates behind the user's back
+        duplicates = cur.execute("""
+            SELECT production_batch_id, roast_batch_id, COUNT(*) as row_count
+            FROM production_sources
+            GROUP BY production_batch_id, roast_batch_id
+            HAVING COUNT(*) > 1
+        """).fetchall()
+        if duplicates:
+            pairs = ', '.join(f"{d['production_batch_id']}/{d['roast_batch_id']} (x{d['row_count']})"
+                              for d in duplicates)
+            logging.warning("Not migrating production_sources: duplicate production/roast batch "
+                            f"links must be resolved first: {pairs}")
+        else:
+            print("Migrating production_sources: rebuilding as WITHOUT ROWID table...")
+            for trigger in STOCK_TRIGGERS:
+                cur.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+            cur.execute(f"CREATE TABLE production_sources_new {_PRODUCTION_SOURCES_SCHEMA}")
+            cur.execute("""
+                INSERT INTO production_sources_new (production_batch_id, roast_batch_id, weight_used_g)
+                SELECT production_batch_id, roast_batch_id, weight_used_g
+                FROM production_sources
+            """)
+            cur.execute("DROP TABLE production_sources")
+            cur.execute("ALTER TABLE production_sources_new RENAME TO production_sources")
+            ps_sql = _PRODUCTION_SOURCES_SCHEMA
+            print("Migration complete: production_sources rebuilt")
 
     # Advent calendar contents (24 days, each from different LOT)
     cur.execute("""
@@ -306,17 +537,41 @@ def init_db():
     """)
 
     # Create indexes
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_roast_batches_lot ON roast_batches(lot_number)")
+    # lot_number is UNIQUE, so its automatic index already serves LOT lookups
+    cur.execute("DROP INDEX IF EXISTS idx_roast_batches_lot")
     cur.execute("CREATE INDEX IF NOT EXISTS idx_roast_batches_date ON roast_batches(roast_date)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_roast_batches_product ON roast_batches(product_id)")
+    # product_id lookups use the (product_id, roast_level, roast_date) index's prefix
+    cur.execute("DROP INDEX IF EXISTS idx_roast_batches_product")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_roast_batches_product_level_date ON roast_batches(product_id, roast_level, roast_date)")
+    # Partial index: only in-stock batches, already in dashboard/production order
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_roast_batches_in_stock ON roast_batches(roast_date DESC) WHERE available_weight_g > 0")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_roast_batches_level_available ON roast_batches(roast_level, available_weight_g)")
+    # Partial index for per-product in-stock lookups (FIFO subtract, oldest first)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_roast_batches_product_in_stock ON roast_batches(product_id, roast_date) WHERE available_weight_g > 0")
     cur.execute("CREATE INDEX IF NOT EXISTS idx_production_date ON production_batches(production_date)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_inventory_adjustments_product ON inventory_adjustments(product_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_production_batches_lot ON production_batches(production_lot)")
+    # Once rebuilt, the primary key covers joins by production batch; this index
+    # the reverse direction
+    if 'WITHOUT ROWID' in ps_sql:
+        cur.execute("DROP INDEX IF EXISTS idx_production_sources_batch")
+    else:
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_production_sources_batch ON production_sources(production_batch_id, roast_batch_id)")
+    cur.execute("DROP INDEX IF EXISTS idx_production_sources_roast")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_production_sources_roast_batch ON production_sources(roast_batch_id, production_batch_id)")
+    # Partial index: packed stock still on the shelf (quantity > 0), by type
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_production_batches_in_stock ON production_batches(production_type, package_size_g) WHERE quantity > 0")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_advent_calendar_contents_lot ON advent_calendar_contents(advent_lot)")
+    # Per-product history, newest first (superseded the product_id-only index)
+    cur.execute("DROP INDEX IF EXISTS idx_inventory_adjustments_product")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_inventory_adjustments_product_date ON inventory_adjustments(product_id, created_at DESC)")
     cur.execute("CREATE INDEX IF NOT EXISTS idx_inventory_adjustments_date ON inventory_adjustments(created_at)")
     cur.execute("CREATE INDEX IF NOT EXISTS idx_order_lot_assignments_order ON order_lot_assignments(wc_order_id)")
     cur.execute("CREATE INDEX IF NOT EXISTS idx_order_lot_assignments_item ON order_lot_assignments(wc_order_item_id)")
     cur.execute("CREATE INDEX IF NOT EXISTS idx_b2b_customers_active ON b2b_customers(is_active)")
     cur.execute("CREATE INDEX IF NOT EXISTS idx_b2b_orders_customer ON b2b_orders(customer_id)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_b2b_orders_status ON b2b_orders(status)")
+    # Open orders newest first (superseded the status-only index)
+    cur.execute("DROP INDEX IF EXISTS idx_b2b_orders_status")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_b2b_orders_status_date ON b2b_orders(status, order_date DESC)")
     cur.execute("CREATE INDEX IF NOT EXISTS idx_b2b_orders_payment ON b2b_orders(payment_status)")
     cur.execute("CREATE INDEX IF NOT EXISTS idx_b2b_order_items_order ON b2b_order_items(order_id)")
 
@@ -331,6 +586,37 @@ def init_db():
         # SQLite doesn't support modifying constraints, but the column already exists
         print("Migration complete: production_batch_id column added")
 
+    # Migration: One assignment per order item slot (api_assign_lot upserts on it).
+    # Older databases could hold duplicates; keep the first row, which is the one
+    # the assignment endpoint used to update, and give every extra row's packed
+    # unit back to its production batch, as removing an assignment does.
+    slot_index = cur.execute("""
+        SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_order_lot_assignments_slot'
+    """).fetchone()
+    if not slot_index:
+        duplicates = cur.execute("""
+            SELECT id, wc_order_id, wc_order_item_id, slot_number, production_batch_id
+            FROM order_lot_assignments WHERE id NOT IN (
+                SELECT MIN(id) FROM order_lot_assignments
+                GROUP BY wc_order_id, wc_order_item_id, slot_number
+            )
+        """).fetchall()
+        if duplicates:
+            cur.executemany("UPDATE production_batches SET quantity = quantity + 1 WHERE id = ?",
+                            [(d['production_batch_id'],) for d in duplicates
+                             if d['production_batch_id'] is not None])
+            cur.executemany("DELETE FROM order_lot_assignments WHERE id = ?",
+                            [(d['id'],) for d in duplicates])
+            rows = ', '.join(f"#{d['id']} (order {d['wc_order_id']} item {d['wc_order_item_id']} "
+                             f"slot {d['slot_number']}, production batch {d['production_batch_id']})"
+                             for d in duplicates)
+            logging.warning(f"Removed {len(duplicates)} duplicate order_lot_assignments rows "
+                            f"and restored their units: {rows}")
+        cur.execute("""
+            CREATE UNIQUE INDEX idx_order_lot_assignments_slot
+            ON order_lot_assignments(wc_order_id, wc_order_item_id, slot_number)
+        """)
+
     # Migration: Add is_archived column to coffee_products if it doesn't exist
     cur.execute("PRAGMA table_info(coffee_products)")
     columns = [col[1] for col in cur.fetchall()]
@@ -367,6 +653,149 @@ def init_db():
         cur.execute("ALTER TABLE b2b_item_invoices ADD COLUMN payment_status TEXT DEFAULT 'unpaid'")
         print("Migration complete: payment_status column added")
 
+    # Stock per product, kept in sync by triggers so the dashboard doesn't
+    # re-aggregate every batch on each load.
+    # roasted_available_g sums all roast batches; in_stock_g only batches with
+    # available_weight_g > 0 (what the stock/analysis views count);
+    # packed_available_g is the weight of shippable packages still in stock
+    # (one entry per production source, like the joins it replaces)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS product_stock (
+            product_id INTEGER PRIMARY KEY,
+            roasted_available_g REAL NOT NULL DEFAULT 0,
+            in_stock_g REAL NOT NULL DEFAULT 0,
+            packed_available_g REAL NOT NULL DEFAULT 0
+        )
+    """)
+    cur.execute("PRAGMA table_info(product_stock)")
+    columns = [col[1] for col in cur.fetchall()]
+    for column in ('in_stock_g', 'packed_available_g'):
+        if column not in columns:
+            print(f"Migrating product_stock: adding {column} column...")
+            cur.execute(f"ALTER TABLE product_stock ADD COLUMN {column} REAL NOT NULL DEFAULT 0")
+            print(f"Migration complete: {column} column added")
+
+    # Triggers are recreated on every init so older definitions get replaced
+    for trigger in STOCK_TRIGGERS:
+        cur.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    cur.execute("""
+        CREATE TRIGGER trg_roast_batches_stock_insert
+        AFTER INSERT ON roast_batches
+        BEGIN
+            INSERT INTO product_stock (product_id, roasted_available_g, in_stock_g)
+            VALUES (NEW.product_id, NEW.available_weight_g, MAX(NEW.available_weight_g, 0))
+            ON CONFLICT(product_id) DO UPDATE
+            SET roasted_available_g = roasted_available_g + excluded.roasted_available_g,
+                in_stock_g = in_stock_g + excluded.in_stock_g;
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER trg_roast_batches_stock_update
+        AFTER UPDATE OF available_weight_g, product_id ON roast_batches
+        BEGIN
+            UPDATE product_stock
+            SET roasted_available_g = roasted_available_g - OLD.available_weight_g,
+                in_stock_g = in_stock_g - MAX(OLD.available_weight_g, 0)
+            WHERE product_id = OLD.product_id;
+            INSERT INTO product_stock (product_id, roasted_available_g, in_stock_g)
+            VALUES (NEW.product_id, NEW.available_weight_g, MAX(NEW.available_weight_g, 0))
+            ON CONFLICT(product_id) DO UPDATE
+            SET roasted_available_g = roasted_available_g + excluded.roasted_available_g,
+                in_stock_g = in_stock_g + excluded.in_stock_g;
+        END
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER trg_roast_batches_stock_delete
+        AFTER DELETE ON roast_batches
+        BEGIN
+            UPDATE product_stock
+            SET roasted_available_g = roasted_available_g - OLD.available_weight_g,
+                in_stock_g = in_stock_g - MAX(OLD.available_weight_g, 0),
+                packed_available_g = packed_available_g - {_packed_from_roast_batch('OLD')}
+            WHERE product_id = OLD.product_id;
+        END
+    """)
+    # Packages sourced from a roast batch follow it to another product
+    cur.execute(f"""
+        CREATE TRIGGER trg_roast_batches_packed_move
+        AFTER UPDATE OF product_id ON roast_batches
+        WHEN OLD.product_id IS NOT NEW.product_id
+        BEGIN
+            INSERT INTO product_stock (product_id) VALUES (NEW.product_id)
+            ON CONFLICT(product_id) DO NOTHING;
+            UPDATE product_stock
+            SET packed_available_g = packed_available_g - {_packed_from_roast_batch('OLD')}
+            WHERE product_id = OLD.product_id;
+            UPDATE product_stock
+            SET packed_available_g = packed_available_g + {_packed_from_roast_batch('NEW')}
+            WHERE product_id = NEW.product_id;
+        END
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER trg_production_sources_stock_insert
+        AFTER INSERT ON production_sources
+        BEGIN
+            UPDATE product_stock
+            SET packed_available_g = packed_available_g + {_packed_for_source('NEW')}
+            WHERE product_id = (SELECT product_id FROM roast_batches WHERE id = NEW.roast_batch_id);
+        END
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER trg_production_sources_stock_update
+        AFTER UPDATE OF production_batch_id, roast_batch_id ON production_sources
+        BEGIN
+            UPDATE product_stock
+            SET packed_available_g = packed_available_g - {_packed_for_source('OLD')}
+            WHERE product_id = (SELECT product_id FROM roast_batches WHERE id = OLD.roast_batch_id);
+            UPDATE product_stock
+            SET packed_available_g = packed_available_g + {_packed_for_source('NEW')}
+            WHERE product_id = (SELECT product_id FROM roast_batches WHERE id = NEW.roast_batch_id);
+        END
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER trg_production_sources_stock_delete
+        AFTER DELETE ON production_sources
+        BEGIN
+            UPDATE product_stock
+            SET packed_available_g = packed_available_g - {_packed_for_source('OLD')}
+            WHERE product_id = (SELECT product_id FROM roast_batches WHERE id = OLD.roast_batch_id);
+        END
+    """)
+    # Quantity changes (assign/unassign a LOT, production) adjust every
+    # product the production batch was sourced from
+    cur.execute(f"""
+        CREATE TRIGGER trg_production_batches_stock_update
+        AFTER UPDATE OF quantity, package_size_g, production_type ON production_batches
+        WHEN {_packed_g('NEW')} != {_packed_g('OLD')}
+        BEGIN
+            UPDATE product_stock
+            SET packed_available_g = packed_available_g
+                + ({_packed_g('NEW')} - {_packed_g('OLD')}) * {_sources_of_product('NEW')}
+            WHERE product_id IN ({_source_products('NEW')});
+        END
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER trg_production_batches_stock_delete
+        AFTER DELETE ON production_batches
+        BEGIN
+            UPDATE product_stock
+            SET packed_available_g = packed_available_g - {_packed_g('OLD')} * {_sources_of_product('OLD')}
+            WHERE product_id IN ({_source_products('OLD')});
+        END
+    """)
+    # Resync from scratch (also backfills databases created before the table existed)
+    cur.execute("DELETE FROM product_stock")
+    cur.execute(f"""
+        INSERT INTO product_stock (product_id, roasted_available_g, in_stock_g, packed_available_g)
+        SELECT rb.product_id, TOTAL(rb.available_weight_g), TOTAL(MAX(rb.available_weight_g, 0)),
+               (SELECT TOTAL({_packed_g('pb')})
+                FROM production_sources ps
+                JOIN roast_batches rb2 ON ps.roast_batch_id = rb2.id
+                JOIN production_batches pb ON ps.production_batch_id = pb.id
+                WHERE rb2.product_id = rb.product_id)
+        FROM roast_batches rb GROUP BY rb.product_id
+    """)
+
     # WooCommerce Order Invoices - tracks invoices for WC orders
     cur.execute("""
         CREATE TABLE IF NOT EXISTS wc_order_invoices (
@@ -379,6 +808,9 @@ def init_db():
     """)
     cur.execute("CREATE INDEX IF NOT EXISTS idx_wc_order_invoices_order ON wc_order_invoices(wc_order_id)")
 
+    # Refresh planner statistics so the partial/composite indexes get picked
+    cur.execute("ANALYZE")
+
     conn.commit()
     conn.close()
     print(f"Database initialized at {DATABASE_PATH}")
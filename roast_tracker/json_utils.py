@@ -0,0 +1,30 @@
+"""
+Fast JSON helpers shared by the POS app and the Roast Tracker blueprint
+"""
+import sqlite3
+
+import orjson
+from flask import Response
+
+json_loads = orjson.loads
+
+
+def _json_default(obj):
+    """Serialize sqlite3.Row (orjson handles date and datetime natively)
+
+    Rows become dicts only here, while being serialized, so endpoints can hand
+    query_db results straight to jsonify_fast without a dict() copy per row.
+    """
+    if isinstance(obj, sqlite3.Row):
+        return dict(zip(obj.keys(), obj))
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def json_bytes(obj) -> bytes:
+    """Serialize obj to compact JSON bytes; accepts sqlite3.Row and dates"""
+    return orjson.dumps(obj, default=_json_default)
+
+
+def jsonify_fast(obj, status_code: int = 200) -> Response:
+    """Like jsonify, but serialized with json_bytes for hot endpoints"""
+    return Response(json_bytes(obj), status=status_code, mimetype='application/json')
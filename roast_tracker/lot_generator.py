@@ -7,8 +7,10 @@ LOT Number Formats:
 - Advent Calendar: AK/YEARMONTHDAY/Y
 - Cold Brew: CB/YEARMONTHDAY/Y
 """
+import re
 from datetime import datetime, date
-from .database import query_db
+from functools import lru_cache
+from .database import query_scalar
 
 
 # Hungarian month abbreviations
@@ -30,6 +32,14 @@ MONTH_CODES = {
 # Reverse lookup for parsing
 MONTH_NUMBERS = {v: k for k, v in MONTH_CODES.items()}
 
+# Month codes indexed by month number (index 0 unused) for formatting
+_MONTH_FMT = [''] + [MONTH_CODES[m] for m in range(1, 13)]
+
+# YEARMONTHDAY matcher; longest month codes first so SZEPT wins the alternation
+_LOT_DATE_RE = re.compile(
+    r'^(\d{4})(' + '|'.join(sorted(MONTH_NUMBERS, key=len, reverse=True)) + r')(\d{1,2})$'
+)
+
 # Roast level codes
 ROAST_LEVELS = {
     'V': 'Világos (Light)',
@@ -38,32 +48,63 @@ ROAST_LEVELS = {
 }
 
 
+@lru_cache(maxsize=2048)
 def format_date_part(d: date) -> str:
     """
     Format date as YEARMONTHDAY for LOT number
     Example: 2025NOV05
     """
-    year = d.year
-    month = MONTH_CODES[d.month]
-    day = f"{d.day:02d}"
-    return f"{year}{month}{day}"
+    return f"{d.year}{_MONTH_FMT[d.month]}{d.day:02d}"
 
 
+@lru_cache(maxsize=2048)
 def parse_date_from_lot(date_part: str) -> date:
     """
     Parse YEARMONTHDAY from LOT number back to date
     Example: 2025NOV05 -> date(2025, 11, 5)
     """
-    year = int(date_part[:4])
+    m = _LOT_DATE_RE.match(date_part)
+    if not m:
+        raise ValueError(f"Could not parse date from: {date_part}")
+    return date(int(m[1]), MONTH_NUMBERS[m[2]], int(m[3]))
+
+
+def lot_prefix_bounds(prefix: str) -> tuple:
+    """
+    Half-open range [low, high) of the LOTs starting with prefix.
+
+    Used as `col >= low AND col < high`, which (unlike LIKE 'prefix%') can
+    be answered from the LOT column's index.
+    """
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def _max_sequence_sql(table: str, column: str) -> str:
+    """Build the MAX(trailing sequence) query for LOTs in table.column"""
+    return (f"SELECT MAX(CAST(substr({column}, ?) AS INTEGER)) FROM {table} "
+            f"WHERE {column} >= ? AND {column} < ?")
+
+
+# Hot LOT queries, built once so each call reuses the connection's statement cache
+_SQL_MAX_ROAST_SEQ = _max_sequence_sql('roast_batches', 'lot_number')
+_SQL_MAX_PRODUCTION_SEQ = _max_sequence_sql('production_batches', 'production_lot')
+_SQL_MAX_ADVENT_SEQ = _max_sequence_sql('advent_calendar_contents', 'advent_lot')
+_SQL_SAME_DAY_LOT = """
+    SELECT lot_number FROM roast_batches
+    WHERE product_id = ? AND roast_level = ? AND roast_date = ?
+    LIMIT 1
+"""
+
 
-    # Find month (variable length due to SZEPT)
-    for month_code, month_num in MONTH_NUMBERS.items():
-        if date_part[4:].startswith(month_code):
-            month = month_num
-            day = int(date_part[4 + len(month_code):])
-            return date(year, month, day)
+def _next_sequence_for_prefix(sql: str, prefix: str) -> int:
+    """
+    Get the next sequence number for LOTs starting with prefix.
 
-    raise ValueError(f"Could not parse date from: {date_part}")
+    The trailing sequence is parsed and aggregated in SQLite, so only one
+    row comes back regardless of how many LOTs share the prefix.
+    """
+    max_seq = query_scalar(sql, (len(prefix) + 1, *lot_prefix_bounds(prefix)))
+    return (max_seq or 0) + 1
 
 
 def get_next_sequence(roast_level: str, roast_date: date) -> int:
@@ -79,24 +120,7 @@ def get_next_sequence(roast_level: str, roast_date: date) -> int:
     """
     date_part = format_date_part(roast_date)
     prefix = f"{roast_level}/{date_part}/"
-
-    # Find existing LOTs for this level and date
-    existing = query_db(
-        "SELECT lot_number FROM roast_batches WHERE lot_number LIKE ?",
-        (f"{prefix}%",)
-    )
-
-    if not existing:
-        return 1
-
-    # Get max sequence
-    max_seq = 0
-    for row in existing:
-        lot = row['lot_number']
-        seq = int(lot.split('/')[-1])
-        max_seq = max(max_seq, seq)
-
-    return max_seq + 1
+    return _next_sequence_for_prefix(_SQL_MAX_ROAST_SEQ, prefix)
 
 
 def generate_roast_lot(roast_level: str, roast_date: date, product_id: int = None, custom_sequence: int = None) -> str:
@@ -121,13 +145,12 @@ def generate_roast_lot(roast_level: str, roast_date: date, product_id: int = Non
 
     # Check if same product already roasted same day with same level
     if product_id:
-        existing = query_db(
-            """SELECT lot_number FROM roast_batches
-               WHERE product_id = ? AND roast_level = ? AND roast_date = ?""",
+        existing_lot = query_scalar(
+            _SQL_SAME_DAY_LOT,
             (product_id, roast_level, roast_date.isoformat())
         )
-        if existing:
-            return existing[0]['lot_number']
+        if existing_lot:
+            return existing_lot
 
     # Use custom sequence if provided, otherwise generate next
     if custom_sequence is not None:
@@ -152,13 +175,7 @@ def generate_drip_lot(roast_level: str, production_date: date) -> str:
     date_part = format_date_part(production_date)
     prefix = f"TG/{roast_level}/{date_part}/"
 
-    # Find existing for today
-    existing = query_db(
-        "SELECT production_lot FROM production_batches WHERE production_lot LIKE ?",
-        (f"{prefix}%",)
-    )
-
-    seq = len(existing) + 1 if existing else 1
+    seq = _next_sequence_for_prefix(_SQL_MAX_PRODUCTION_SEQ, prefix)
     return f"TG/{roast_level}/{date_part}/{seq}"
 
 
@@ -176,13 +193,7 @@ def generate_advent_lot(production_date: date) -> str:
     date_part = format_date_part(production_date)
     prefix = f"AK/{date_part}/"
 
-    # Find existing for today
-    existing = query_db(
-        "SELECT DISTINCT advent_lot FROM advent_calendar_contents WHERE advent_lot LIKE ?",
-        (f"{prefix}%",)
-    )
-
-    seq = len(existing) + 1 if existing else 1
+    seq = _next_sequence_for_prefix(_SQL_MAX_ADVENT_SEQ, prefix)
     return f"AK/{date_part}/{seq}"
 
 
@@ -200,13 +211,7 @@ def generate_cold_brew_lot(production_date: date) -> str:
     date_part = format_date_part(production_date)
     prefix = f"CB/{date_part}/"
 
-    # Find existing for today
-    existing = query_db(
-        "SELECT production_lot FROM production_batches WHERE production_lot LIKE ?",
-        (f"{prefix}%",)
-    )
-
-    seq = len(existing) + 1 if existing else 1
+    seq = _next_sequence_for_prefix(_SQL_MAX_PRODUCTION_SEQ, prefix)
     return f"CB/{date_part}/{seq}"
 
 
@@ -4,17 +4,40 @@ RoastTime Data Import for Cafe Tiko Roast Tracker
 Imports roast data from Aillio Bullet RoastTime application.
 Default location: C:/Users/{user}/AppData/Roaming/roast-time/roasts/
 """
-import json
 import os
+import time
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import lru_cache
 from typing import Optional, List, Dict, Any
 
+from .json_utils import json_loads
+
 
 # Default RoastTime data location
 DEFAULT_ROASTTIME_PATH = os.path.expanduser(
     "~/AppData/Roaming/roast-time/roasts"
 )
 
+# Parsed roasts keyed by filepath -> (mtime_ns, parsed dict)
+# RoastTime edits files in place (e.g. roasted weight entered later), so
+# each file is re-parsed only when its own mtime changes
+_parsed_file_cache = {}
+
+# Per directory: signature of (filepath, mtime_ns) plus the sorted roast list
+# and lookup structures derived from it (rebuilt together when files change)
+_roast_list_cache = {}
+
+# Threads used to parse changed/new roast files when rebuilding the list
+# (file reads release the GIL, so a cold load isn't one file at a time)
+PARSE_WORKERS = 8
+
+# How long a roast list is trusted without re-statting every file. Added or
+# deleted roasts change the directory mtime and are picked up immediately;
+# in-place edits to an existing file show up once this window has passed.
+ROAST_LIST_TTL_SECONDS = 30
+
 
 def get_roasttime_path() -> str:
     """Get the RoastTime roasts directory path"""
@@ -34,17 +57,21 @@ def get_roasttime_path() -> str:
 def load_roast_file(filepath: str) -> Optional[Dict[str, Any]]:
     """Load a single RoastTime JSON file"""
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        with open(filepath, 'rb') as f:
+            return json_loads(f.read())
     except Exception as e:
         print(f"Error loading {filepath}: {e}")
         return None
 
 
-def parse_roast_data(data: Dict[str, Any]) -> Dict[str, Any]:
+def parse_roast_data(data: Dict[str, Any], summary_only: bool = False) -> Dict[str, Any]:
     """
     Parse RoastTime data into our format.
 
+    With summary_only=True the time series (bean_temps, drum_temps, ror)
+    are returned as None so cached roast lists don't hold thousands of
+    samples per roast.
+
     Returns dict with:
         - roasttime_uid: Original file UID
         - roast_name: Name from RoastTime
@@ -105,8 +132,11 @@ def parse_roast_data(data: Dict[str, Any]) -> Dict[str, Any]:
     roast_number = data.get('roastNumber', 0)
 
     # Time series data
-    drum_temps = data.get('drumTemperature', [])
-    ror = data.get('beanDerivative', [])  # Rate of Rise
+    if summary_only:
+        bean_temps = drum_temps = ror = None
+    else:
+        drum_temps = data.get('drumTemperature', [])
+        ror = data.get('beanDerivative', [])  # Rate of Rise
 
     return {
         'roasttime_uid': uid,
@@ -141,101 +171,225 @@ def list_roast_files(path: str = None) -> List[str]:
     if not os.path.exists(path):
         return []
 
-    files = []
-    for f in os.listdir(path):
-        filepath = os.path.join(path, f)
-        if os.path.isfile(filepath):
-            files.append(filepath)
+    # scandir entries know their type, so no extra stat per file
+    with os.scandir(path) as it:
+        return [entry.path for entry in it if entry.is_file()]
+
 
+def _scan_roast_files(path: str) -> List[tuple]:
+    """List (filepath, mtime_ns) for all roast files, sorted by path"""
+    if not os.path.exists(path):
+        return []
+
+    files = []
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                if entry.is_file():
+                    files.append((entry.path, entry.stat().st_mtime_ns))
+            except OSError:
+                pass
+    files.sort()
     return files
 
 
-def load_all_roasts(path: str = None) -> List[Dict[str, Any]]:
-    """Load and parse all roasts from RoastTime"""
-    files = list_roast_files(path)
-    roasts = []
+def _parse_roast_summary(filepath: str) -> Optional[Dict[str, Any]]:
+    """Read and parse a roast file in summary mode (no caching)"""
+    data = load_roast_file(filepath)
+    return parse_roast_data(data, summary_only=True) if data else None
+
+
+def load_parsed_roast(filepath: str) -> Optional[Dict[str, Any]]:
+    """Load and parse a roast summary, reusing the cached result if unchanged"""
+    try:
+        mtime = os.stat(filepath).st_mtime_ns
+    except OSError:
+        return None
+
+    cached = _parsed_file_cache.get(filepath)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    parsed = _parse_roast_summary(filepath)
+    _parsed_file_cache[filepath] = (mtime, parsed)
+    return parsed
+
 
-    for filepath in files:
-        data = load_roast_file(filepath)
-        if data:
-            parsed = parse_roast_data(data)
+def _get_roast_index(path: str = None) -> Dict[str, Any]:
+    """Get the cached roast list and its lookup structures for a directory"""
+    if path is None:
+        path = get_roasttime_path()
+
+    try:
+        dir_mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        dir_mtime = None
+
+    cached = _roast_list_cache.get(path)
+    now = time.monotonic()
+    if (cached and cached['dir_mtime'] == dir_mtime
+            and now - cached['checked_at'] < ROAST_LIST_TTL_SECONDS):
+        return cached
+
+    signature = tuple(_scan_roast_files(path))
+
+    if cached and cached['signature'] == signature:
+        cached['dir_mtime'] = dir_mtime
+        cached['checked_at'] = now
+        return cached
+
+    # Parse only new/changed files, in parallel
+    stale = []
+    for filepath, mtime in signature:
+        entry = _parsed_file_cache.get(filepath)
+        if not entry or entry[0] != mtime:
+            stale.append((filepath, mtime))
+
+    if len(stale) > 1:
+        with ThreadPoolExecutor(max_workers=min(PARSE_WORKERS, len(stale))) as ex:
+            parsed_stale = list(ex.map(_parse_roast_summary, [f for f, _ in stale]))
+    else:
+        parsed_stale = [_parse_roast_summary(f) for f, _ in stale]
+
+    for (filepath, mtime), parsed in zip(stale, parsed_stale):
+        _parsed_file_cache[filepath] = (mtime, parsed)
+
+    # Forget files that were deleted or renamed since the last build
+    live = {filepath for filepath, _ in signature}
+    prefix = os.path.join(path, '')
+    for filepath in [f for f in _parsed_file_cache
+                     if f.startswith(prefix) and f not in live]:
+        del _parsed_file_cache[filepath]
+
+    roasts = []
+    for filepath, _ in signature:
+        parsed = _parsed_file_cache[filepath][1]
+        if parsed:
             roasts.append(parsed)
 
     # Sort by date, newest first
     roasts.sort(key=lambda x: x['roast_date'] or datetime.min, reverse=True)
-    return roasts
+
+    # Dated roasts oldest first, with a parallel key list for bisecting
+    roasts_by_date = [r for r in reversed(roasts) if r['roast_date']]
+
+    index = {
+        'signature': signature,
+        'version': hash(signature),
+        'dir_mtime': dir_mtime,
+        'checked_at': now,
+        'roasts': roasts,
+        'roasts_by_date': roasts_by_date,
+        'date_keys': [r['roast_date'] for r in roasts_by_date],
+        'names_lower': [r['roast_name'].lower() for r in roasts],
+        'summary': None,
+        'guessed_levels': None,
+        'by_uid': None,
+    }
+    _roast_list_cache[path] = index
+    return index
+
+
+def load_all_roasts(path: str = None) -> List[Dict[str, Any]]:
+    """Load and parse all roasts from RoastTime (cached, see ROAST_LIST_TTL_SECONDS)"""
+    return _get_roast_index(path)['roasts']
+
+
+def roast_list_version(path: str = None) -> int:
+    """Identifier of the cached roast list; changes whenever the list changes"""
+    return _get_roast_index(path)['version']
 
 
 def get_roast_by_uid(uid: str, path: str = None) -> Optional[Dict[str, Any]]:
-    """Load a specific roast by its UID"""
+    """Load a specific roast summary by its UID (no time series)"""
     if path is None:
         path = get_roasttime_path()
 
+    # UID (file name) -> parsed summary, built once per cache build
+    index = _get_roast_index(path)
+    if index['by_uid'] is None:
+        index['by_uid'] = {
+            os.path.basename(filepath): _parsed_file_cache[filepath][1]
+            for filepath, _ in index['signature']
+        }
+    if uid in index['by_uid']:
+        return index['by_uid'][uid]
+
+    # Not in the cached list (yet): read the file directly
     filepath = os.path.join(path, uid)
     if os.path.exists(filepath):
-        data = load_roast_file(filepath)
-        if data:
-            return parse_roast_data(data)
+        return load_parsed_roast(filepath)
 
     return None
 
 
 def search_roasts_by_name(search_term: str, path: str = None) -> List[Dict[str, Any]]:
     """Search roasts by name"""
-    all_roasts = load_all_roasts(path)
+    index = _get_roast_index(path)
     search_lower = search_term.lower()
-    return [r for r in all_roasts if search_lower in r['roast_name'].lower()]
+    return [r for r, name in zip(index['roasts'], index['names_lower']) if search_lower in name]
 
 
 def get_roasts_by_date_range(start_date: datetime, end_date: datetime, path: str = None) -> List[Dict[str, Any]]:
-    """Get roasts within a date range"""
-    all_roasts = load_all_roasts(path)
-    return [
-        r for r in all_roasts
-        if r['roast_date'] and start_date <= r['roast_date'] <= end_date
-    ]
+    """Get roasts within a date range (newest first)"""
+    index = _get_roast_index(path)
+    date_keys = index['date_keys']
+    lo = bisect_left(date_keys, start_date)
+    hi = bisect_right(date_keys, end_date)
+    return index['roasts_by_date'][lo:hi][::-1]
 
 
 def get_roast_summary(path: str = None) -> Dict[str, Any]:
-    """Get summary statistics of all roasts"""
-    roasts = load_all_roasts(path)
+    """Get summary statistics of all roasts (computed once per cache build)"""
+    index = _get_roast_index(path)
+    if index['summary'] is not None:
+        return index['summary']
+
+    roasts = index['roasts']
 
     if not roasts:
         return {'count': 0}
 
-    total_green = sum(r['green_weight_g'] for r in roasts)
-    total_roasted = sum(r['roasted_weight_g'] for r in roasts)
-
-    return {
+    # Single pass over the list for all totals and the date range
+    total_green = 0
+    total_roasted = 0
+    total_loss = 0
+    earliest = None
+    latest = None
+    for r in roasts:
+        total_green += r['green_weight_g']
+        total_roasted += r['roasted_weight_g']
+        total_loss += r['weight_loss_percent']
+        roast_date = r['roast_date']
+        if roast_date:
+            if earliest is None or roast_date < earliest:
+                earliest = roast_date
+            if latest is None or roast_date > latest:
+                latest = roast_date
+
+    index['summary'] = {
         'count': len(roasts),
         'total_green_kg': round(total_green / 1000, 2),
         'total_roasted_kg': round(total_roasted / 1000, 2),
-        'avg_weight_loss': round(sum(r['weight_loss_percent'] for r in roasts) / len(roasts), 2),
-        'earliest': min(r['roast_date'] for r in roasts if r['roast_date']),
-        'latest': max(r['roast_date'] for r in roasts if r['roast_date']),
+        'avg_weight_loss': round(total_loss / len(roasts), 2),
+        'earliest': earliest,
+        'latest': latest,
     }
+    return index['summary']
 
 
 # Guess roast level from name or characteristics
-def guess_roast_level(roast_data: Dict[str, Any]) -> str:
-    """
-    Attempt to guess roast level (V, K, S) from roast data.
-    Based on weight loss and drop temperature.
-
-    Light (V): ~11-13% loss, drop temp ~200-210°C
-    Medium (K): ~13-15% loss, drop temp ~210-220°C
-    Dark (S): ~15-18% loss, drop temp ~220-230°C
-    """
-    loss = roast_data.get('weight_loss_percent', 0)
-    drop = roast_data.get('drop_temp', 0)
-
+# Memoized on the inputs, so unchanged roasts aren't re-guessed when the
+# roast list is rebuilt after another file changes
+@lru_cache(maxsize=4096)
+def _guess_level(name_lower: str, loss: float, drop: float) -> str:
+    """Roast level rules shared by the single and bulk guessers"""
     # Check name first for explicit hints
-    name = roast_data.get('roast_name', '').lower()
-    if 'light' in name or 'világos' in name:
+    if 'light' in name_lower or 'világos' in name_lower:
         return 'V'
-    if 'dark' in name or 'sötét' in name:
+    if 'dark' in name_lower or 'sötét' in name_lower:
         return 'S'
-    if 'medium' in name or 'közép' in name:
+    if 'medium' in name_lower or 'közép' in name_lower:
         return 'K'
 
     # Guess from metrics
@@ -247,6 +401,37 @@ def guess_roast_level(roast_data: Dict[str, Any]) -> str:
         return 'K'
 
 
+def guess_roast_level(roast_data: Dict[str, Any]) -> str:
+    """
+    Attempt to guess roast level (V, K, S) from roast data.
+    Based on weight loss and drop temperature.
+
+    Light (V): ~11-13% loss, drop temp ~200-210°C
+    Medium (K): ~13-15% loss, drop temp ~210-220°C
+    Dark (S): ~15-18% loss, drop temp ~220-230°C
+    """
+    return _guess_level(
+        roast_data.get('roast_name', '').lower(),
+        roast_data.get('weight_loss_percent', 0),
+        roast_data.get('drop_temp', 0)
+    )
+
+
+def guess_roast_levels(path: str = None) -> List[str]:
+    """
+    Guess roast levels for all cached roasts, parallel to load_all_roasts().
+
+    Computed once per cache build from the prebuilt lowercase names.
+    """
+    index = _get_roast_index(path)
+    if index['guessed_levels'] is None:
+        index['guessed_levels'] = [
+            _guess_level(name, r['weight_loss_percent'], r['drop_temp'])
+            for r, name in zip(index['roasts'], index['names_lower'])
+        ]
+    return index['guessed_levels']
+
+
 if __name__ == "__main__":
     # Test the module
     print(f"RoastTime path: {get_roasttime_path()}")
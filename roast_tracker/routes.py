@@ -1,25 +1,231 @@
 """
 Flask routes for Roast Tracker
 """
+import copy
+import hashlib
+import json
 import os
-from flask import Blueprint, render_template, request, jsonify, redirect, url_for, flash
+import sqlite3
+import time
+from flask import Blueprint, render_template, request, jsonify, redirect, url_for, flash, Response
 from datetime import datetime, date, timedelta
 from functools import wraps
-from .database import get_db, query_db, init_db
+from itertools import islice
+from .json_utils import jsonify_fast
+from .database import (
+    get_db, query_db, query_many, init_db, release_thread_db, change_serial, PACKED_TYPES_SQL
+)
 from .lot_generator import (
     generate_roast_lot, generate_drip_lot, generate_advent_lot,
-    generate_cold_brew_lot, parse_lot_number, ROAST_LEVELS, MONTH_CODES
+    generate_cold_brew_lot, parse_lot_number, lot_prefix_bounds, ROAST_LEVELS, MONTH_CODES
 )
 from .roasttime_import import (
     load_all_roasts, get_roast_by_uid, get_roast_summary,
-    guess_roast_level, get_roasttime_path
+    guess_roast_level, guess_roast_levels, get_roasttime_path, roast_list_version
 )
 
+try:
+    import ahocorasick
+except ImportError:  # Fall back to per-name substring checks
+    ahocorasick = None
+
+# Source LOT numbers of production batch pb (correlated, via the production_sources key)
+_SQL_SOURCE_LOTS = """(
+            SELECT GROUP_CONCAT(rb.lot_number)
+            FROM production_sources ps
+            JOIN roast_batches rb ON ps.roast_batch_id = rb.id
+            WHERE ps.production_batch_id = pb.id
+        )"""
+
+# ORDER BY term for coffee_products cp: light (V), medium (K), dark (S), then anything else
+_SQL_ROAST_LEVEL_SORT = 'CASE cp.roast_level {} ELSE {} END'.format(
+    ' '.join(f"WHEN '{level}' THEN {i}" for i, level in enumerate(ROAST_LEVELS, 1)),
+    len(ROAST_LEVELS) + 1)
+
 roast_tracker = Blueprint('roast_tracker', __name__,
                           template_folder='../templates/roast_tracker',
                           url_prefix='/roast')
 
 
+# How long a client may reuse a polled JSON API response without asking again
+API_MAX_AGE_SECONDS = 5
+
+
+def _versioned_json(body, version):
+    """
+    Response for a serialized JSON body identified by `version`.
+
+    The ETag is derived from `version`; pass body=None to only answer a
+    matching If-None-Match (returns None if the client's copy is stale).
+    """
+    etag = hashlib.blake2b(repr(version).encode(), digest_size=16).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    elif body is None:
+        return None
+    else:
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    # Behind the tracker login, so browser cache only
+    response.cache_control.private = True
+    response.cache_control.max_age = API_MAX_AGE_SECONDS
+    return response
+
+
+# Serialized JSON bodies of in-stock batch APIs (and the rows of in-stock batch
+# views), reused until the database changes at all:
+# name -> (change key, body bytes or rows).
+# The bodies join batch notes, LOT labels and product/green coffee fields, so
+# the key is the database change serial rather than anything stock-specific.
+# The process start time is part of it (and so of the ETag) so ETags from
+# before a restart never match.
+_stock_response_cache = {}
+_stock_response_generation = time.time_ns()
+
+
+def _stock_cache_key(name):
+    return (name, _stock_response_generation, change_serial())
+
+
+def _stock_cached_rows(name, build):
+    """Return build() (query rows for a page), reused while the database is unchanged"""
+    key = _stock_cache_key(name)
+    cached = _stock_response_cache.get(name)
+    if cached and cached[0] == key:
+        return cached[1]
+
+    rows = build()
+    _stock_response_cache[name] = (key, rows)
+    return rows
+
+
+def _stock_cached_json(name, build):
+    """
+    Return build() as JSON, reusing the serialized body while the database is unchanged.
+
+    The change key doubles as the ETag, so a client polling with
+    If-None-Match gets a 304 without the body being looked up or built.
+    The key is read before build() runs, so a write racing with the
+    build can only make the cached body newer than its key (next call rebuilds).
+    """
+    key = _stock_cache_key(name)
+    not_modified = _versioned_json(None, key)
+    if not_modified:
+        return not_modified
+
+    cached = _stock_response_cache.get(name)
+    if cached and cached[0] == key:
+        return _versioned_json(cached[1], key)
+
+    body = jsonify_fast(build()).get_data()
+    _stock_response_cache[name] = (key, body)
+    return _versioned_json(body, key)
+
+
+# Hot write statements, shared by every handler that runs them so each
+# connection's statement cache holds a single prepared copy
+# New roast batch, or the weights added to the existing batch with the same LOT
+_SQL_UPSERT_ROAST_BATCH = """
+    INSERT INTO roast_batches (
+        lot_number, product_id, roast_date, roast_level, day_sequence,
+        green_weight_g, roasted_weight_g, available_weight_g, weight_loss_percent,
+        roasttime_uid, preheat_temp, charge_temp, first_crack_time, first_crack_temp,
+        drop_temp, total_roast_time, ambient_temp, humidity, notes
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(lot_number) DO UPDATE SET
+        green_weight_g = green_weight_g + excluded.green_weight_g,
+        roasted_weight_g = roasted_weight_g + excluded.roasted_weight_g,
+        available_weight_g = available_weight_g + excluded.available_weight_g
+    RETURNING id
+"""
+_SQL_ROAST_LOT_EXISTS = "SELECT 1 FROM roast_batches WHERE lot_number = ?"
+_SQL_DEDUCT_ROAST_BATCH = "UPDATE roast_batches SET available_weight_g = available_weight_g - ? WHERE id = ?"
+_SQL_INSERT_PRODUCTION_SOURCE = """
+    INSERT INTO production_sources (production_batch_id, roast_batch_id, weight_used_g)
+    VALUES (?, ?, ?)
+"""
+_SQL_RESTORE_PRODUCTION_UNIT = """
+    UPDATE production_batches SET quantity = quantity + 1 WHERE id = ?
+"""
+_SQL_DEDUCT_PRODUCTION_UNIT = """
+    UPDATE production_batches SET quantity = quantity - 1 WHERE id = ?
+    RETURNING production_lot, quantity
+"""
+# One row per order item slot (idx_order_lot_assignments_slot)
+_SQL_UPSERT_LOT_ASSIGNMENT = """
+    INSERT INTO order_lot_assignments
+    (wc_order_id, wc_order_item_id, slot_number, production_batch_id, roast_batch_id, weight_g)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(wc_order_id, wc_order_item_id, slot_number) DO UPDATE SET
+        production_batch_id = excluded.production_batch_id,
+        roast_batch_id = excluded.roast_batch_id,
+        weight_g = excluded.weight_g,
+        assigned_at = CURRENT_TIMESTAMP
+"""
+# Single-batch adjustment applied in the UPDATE itself (subtract floors at 0,
+# set/correction overwrite). Params: adjustment_type, amount_g x3, batch id, product id
+_SQL_ADJUST_BATCH_WEIGHT = """
+    UPDATE roast_batches SET available_weight_g = CASE ?
+        WHEN 'add' THEN available_weight_g + ?
+        WHEN 'subtract' THEN MAX(0, available_weight_g - ?)
+        ELSE ?
+    END
+    WHERE id = ? AND product_id = ?
+    RETURNING id
+"""
+# FIFO subtract: each in-stock batch (oldest first) gives up whatever part of
+# the amount the older batches did not already cover.
+# Params: product_id, amount_g, amount_g
+_SQL_FIFO_SUBTRACT = """
+    WITH ranked AS (
+        SELECT id, available_weight_g,
+               SUM(available_weight_g) OVER (
+                   ORDER BY roast_date, id ROWS UNBOUNDED PRECEDING
+               ) - available_weight_g as taken_before
+        FROM roast_batches
+        WHERE product_id = ? AND available_weight_g > 0
+    )
+    UPDATE roast_batches
+    SET available_weight_g = roast_batches.available_weight_g
+        - MIN(ranked.available_weight_g, ? - ranked.taken_before)
+    FROM ranked
+    WHERE roast_batches.id = ranked.id AND ranked.taken_before < ?
+"""
+# Adjustment batch in one statement: the lot sequence is a range read on the
+# lot_number unique index, and the roast level comes from the product ('K' fallback)
+_SQL_INSERT_ADJUSTMENT_BATCH = """
+    INSERT INTO roast_batches
+    (lot_number, product_id, roast_date, roast_level, day_sequence,
+     green_weight_g, roasted_weight_g, available_weight_g, notes)
+    VALUES (
+        ? || (SELECT COALESCE(MAX(CAST(substr(lot_number, ?) AS INTEGER)), 0) + 1
+              FROM roast_batches WHERE lot_number >= ? AND lot_number < ?),
+        ?, ?,
+        COALESCE((SELECT roast_level FROM coffee_products WHERE id = ?), 'K'),
+        1, ?, ?, ?, ?
+    )
+"""
+# Total roasted stock of a product (all its batches), from the
+# trigger-maintained product_stock table instead of a SUM over roast_batches
+_SQL_PRODUCT_STOCK_TOTAL = """
+    SELECT COALESCE(
+        (SELECT roasted_available_g FROM product_stock WHERE product_id = ?), 0
+    ) as total
+"""
+_SQL_INSERT_ADVENT_CONTENT = """
+    INSERT INTO advent_calendar_contents (advent_lot, calendar_year, day_number, roast_batch_id, weight_g)
+    VALUES (?, ?, ?, ?, ?)
+"""
+
+
+def _fast_iso_date(s: str) -> date:
+    """Parse a YYYY-MM-DD form/JSON date (C fast path, strptime for odd input)"""
+    try:
+        return date.fromisoformat(s)
+    except ValueError:
+        return datetime.strptime(s, '%Y-%m-%d').date()
+
+
 # Simple login check (reuse from main app)
 def tracker_login_required(f):
     @wraps(f)
@@ -35,66 +241,48 @@ def tracker_login_required(f):
 @tracker_login_required
 def dashboard():
     """Main dashboard showing available roasted coffee"""
-    # Get roast batches with available stock
-    batches = query_db("""
+    LOW_STOCK_THRESHOLD = 300
+
+    # All dashboard panels are read in one transaction on one cursor
+    (batches, low_stock_products, recent_production, packed_products,
+     totals) = query_many(
+        # Roast batches with available stock
+        """
         SELECT rb.*, cp.name as product_name, gc.country
         FROM roast_batches rb
         JOIN coffee_products cp ON rb.product_id = cp.id
         LEFT JOIN green_coffee gc ON cp.green_coffee_id = gc.id
         WHERE rb.available_weight_g > 0
         ORDER BY rb.roast_date DESC
-    """)
-
-    # Get low stock alerts by PRODUCT (less than 300g total, including 0g)
-    # Includes BOTH unpacked roasted coffee AND packed products still in inventory
-    # Excludes archived products
-    LOW_STOCK_THRESHOLD = 300
-    low_stock_products = query_db("""
-        SELECT cp.id, cp.name as product_name, cp.roast_level,
-               gc.country,
-               COALESCE(SUM(rb.available_weight_g), 0) as roasted_available_g,
-               COALESCE(
-                   (SELECT SUM(pb.quantity * pb.package_size_g)
-                    FROM production_batches pb
-                    JOIN production_sources ps ON pb.id = ps.production_batch_id
-                    JOIN roast_batches rb2 ON ps.roast_batch_id = rb2.id
-                    WHERE rb2.product_id = cp.id AND pb.quantity > 0
-                      AND pb.production_type IN ('whole_bean_250', 'whole_bean_70', 'whole_bean_16', 'drip_11')
-                   ), 0
-               ) as packed_available_g,
-               COALESCE(SUM(rb.available_weight_g), 0) +
-               COALESCE(
-                   (SELECT SUM(pb.quantity * pb.package_size_g)
-                    FROM production_batches pb
-                    JOIN production_sources ps ON pb.id = ps.production_batch_id
-                    JOIN roast_batches rb2 ON ps.roast_batch_id = rb2.id
-                    WHERE rb2.product_id = cp.id AND pb.quantity > 0
-                      AND pb.production_type IN ('whole_bean_250', 'whole_bean_70', 'whole_bean_16', 'drip_11')
-                   ), 0
-               ) as total_available_g
-        FROM coffee_products cp
-        LEFT JOIN green_coffee gc ON cp.green_coffee_id = gc.id
-        LEFT JOIN roast_batches rb ON cp.id = rb.product_id
-        WHERE cp.is_active = 1 AND COALESCE(cp.is_archived, 0) = 0
-        GROUP BY cp.id
-        HAVING total_available_g < ?
+    """,
+        # Low stock alerts by PRODUCT (less than 300g total, including 0g)
+        # Includes BOTH unpacked roasted coffee AND packed products still in
+        # inventory, both kept per product in product_stock. Excludes archived products
+        ("""
+        SELECT s.*, s.roasted_available_g + s.packed_available_g as total_available_g
+        FROM (
+            SELECT cp.id, cp.name as product_name, cp.roast_level,
+                   gc.country,
+                   COALESCE(ps.roasted_available_g, 0) as roasted_available_g,
+                   COALESCE(ps.packed_available_g, 0) as packed_available_g
+            FROM coffee_products cp
+            LEFT JOIN green_coffee gc ON cp.green_coffee_id = gc.id
+            LEFT JOIN product_stock ps ON ps.product_id = cp.id
+            WHERE cp.is_active = 1 AND COALESCE(cp.is_archived, 0) = 0
+        ) s
+        WHERE s.roasted_available_g + s.packed_available_g < ?
         ORDER BY total_available_g ASC
-    """, (LOW_STOCK_THRESHOLD,))
-
-    # Get recent production
-    recent_production = query_db("""
-        SELECT pb.*, GROUP_CONCAT(rb.lot_number) as source_lots
+    """, (LOW_STOCK_THRESHOLD,)),
+        # Recent production: source LOTs looked up for the 10 batches only
+        f"""
+        SELECT pb.*, {_SQL_SOURCE_LOTS} as source_lots
         FROM production_batches pb
-        LEFT JOIN production_sources ps ON pb.id = ps.production_batch_id
-        LEFT JOIN roast_batches rb ON ps.roast_batch_id = rb.id
-        GROUP BY pb.id
-        ORDER BY pb.production_date DESC
+        ORDER BY pb.production_date DESC, pb.id
         LIMIT 10
-    """)
-
-    # Get packed products (ready to ship) grouped by product
-    # Sorted by origin (country), then roast level (V=light, K=medium, S=dark)
-    packed_products = query_db("""
+    """,
+        # Packed products (ready to ship) grouped by product
+        # Sorted by origin (country), then roast level (V=light, K=medium, S=dark)
+        f"""
         SELECT
             cp.id as product_id,
             cp.name as product_name,
@@ -109,23 +297,32 @@ def dashboard():
         JOIN coffee_products cp ON rb.product_id = cp.id
         LEFT JOIN green_coffee gc ON cp.green_coffee_id = gc.id
         WHERE pb.quantity > 0
-          AND pb.production_type IN ('whole_bean_250', 'whole_bean_70', 'whole_bean_16', 'drip_11')
+          AND pb.production_type IN ({PACKED_TYPES_SQL})
         GROUP BY cp.id, pb.package_size_g
         ORDER BY gc.country,
-                 CASE cp.roast_level
-                     WHEN 'V' THEN 1
-                     WHEN 'K' THEN 2
-                     WHEN 'S' THEN 3
-                     ELSE 4
-                 END,
+                 {_SQL_ROAST_LEVEL_SORT},
                  pb.package_size_g DESC
-    """)
-
-    # Calculate total packed weight
-    total_packed = sum(p['total_quantity'] * p['package_size_g'] for p in packed_products) if packed_products else 0
+    """,
+        # Summary stats: total unpacked roasted stock and total packed weight
+        # (same rows as the packed products panel above)
+        f"""
+        SELECT
+            (SELECT COALESCE(SUM(available_weight_g), 0)
+             FROM roast_batches
+             WHERE available_weight_g > 0) as total_available_g,
+            (SELECT COALESCE(SUM(pb.quantity * pb.package_size_g), 0)
+             FROM production_batches pb
+             JOIN production_sources ps ON pb.id = ps.production_batch_id
+             JOIN roast_batches rb ON ps.roast_batch_id = rb.id
+             JOIN coffee_products cp ON rb.product_id = cp.id
+             WHERE pb.quantity > 0
+               AND pb.production_type IN ({PACKED_TYPES_SQL})
+            ) as total_packed_g
+    """,
+    )
 
-    # Summary stats
-    total_available = sum(b['available_weight_g'] for b in batches) if batches else 0
+    total_available = totals[0]['total_available_g']
+    total_packed = totals[0]['total_packed_g']
 
     return render_template('roast_tracker/dashboard.html',
                            batches=batches,
@@ -152,71 +349,65 @@ def new_roast():
         custom_sequence = request.form.get('custom_sequence', type=int)
 
         # Parse date
-        roast_date = datetime.strptime(roast_date_str, '%Y-%m-%d').date()
+        try:
+            roast_date = _fast_iso_date(roast_date_str)
+        except (TypeError, ValueError):
+            flash('Invalid roast date', 'error')
+            return redirect(url_for('roast_tracker.new_roast'))
 
         # Generate LOT number (with custom sequence if provided)
         lot_number = generate_roast_lot(roast_level, roast_date, product_id, custom_sequence)
 
-        # Check if LOT already exists (same product, same day, same level)
-        existing = query_db(
-            "SELECT id FROM roast_batches WHERE lot_number = ?",
-            (lot_number,), one=True
-        )
+        # Calculate weight loss
+        weight_loss = ((green_weight - roasted_weight) / green_weight * 100) if green_weight > 0 else 0
+
+        # Get RoastTime data if UID provided
+        fc_time = None
+        fc_temp = None
+        drop_temp = None
+        total_time = None
+        preheat = None
+        charge_temp = None
+        ambient = None
+        humidity = None
+
+        if roasttime_uid:
+            rt_data = get_roast_by_uid(roasttime_uid)
+            if rt_data:
+                fc_time = rt_data.get('first_crack_time')
+                fc_temp = rt_data.get('first_crack_temp')
+                drop_temp = rt_data.get('drop_temp')
+                total_time = rt_data.get('total_roast_time')
+                preheat = rt_data.get('preheat_temp')
+                charge_temp = rt_data.get('charge_temp')
+                ambient = rt_data.get('ambient_temp')
+                humidity = rt_data.get('humidity')
+
+        # Get day sequence
+        day_seq = int(lot_number.split('/')[-1])
 
-        if existing:
-            # Add to existing batch
-            query_db("""
-                UPDATE roast_batches
-                SET green_weight_g = green_weight_g + ?,
-                    roasted_weight_g = roasted_weight_g + ?,
-                    available_weight_g = available_weight_g + ?
-                WHERE lot_number = ?
-            """, (green_weight, roasted_weight, roasted_weight, lot_number))
-            flash(f'Added to existing batch {lot_number}', 'success')
-        else:
-            # Calculate weight loss
-            weight_loss = ((green_weight - roasted_weight) / green_weight * 100) if green_weight > 0 else 0
-
-            # Get RoastTime data if UID provided
-            fc_time = None
-            fc_temp = None
-            drop_temp = None
-            total_time = None
-            preheat = None
-            charge_temp = None
-            ambient = None
-            humidity = None
-
-            if roasttime_uid:
-                rt_data = get_roast_by_uid(roasttime_uid)
-                if rt_data:
-                    fc_time = rt_data.get('first_crack_time')
-                    fc_temp = rt_data.get('first_crack_temp')
-                    drop_temp = rt_data.get('drop_temp')
-                    total_time = rt_data.get('total_roast_time')
-                    preheat = rt_data.get('preheat_temp')
-                    charge_temp = rt_data.get('charge_temp')
-                    ambient = rt_data.get('ambient_temp')
-                    humidity = rt_data.get('humidity')
-
-            # Get day sequence
-            day_seq = int(lot_number.split('/')[-1])
-
-            # Insert new batch
-            query_db("""
-                INSERT INTO roast_batches (
-                    lot_number, product_id, roast_date, roast_level, day_sequence,
-                    green_weight_g, roasted_weight_g, available_weight_g, weight_loss_percent,
-                    roasttime_uid, preheat_temp, charge_temp, first_crack_time, first_crack_temp,
-                    drop_temp, total_roast_time, ambient_temp, humidity, notes
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                lot_number, product_id, roast_date.isoformat(), roast_level, day_seq,
-                green_weight, roasted_weight, roasted_weight, weight_loss,
-                roasttime_uid, preheat, charge_temp, fc_time, fc_temp,
-                drop_temp, total_time, ambient, humidity, notes
-            ))
+        conn = get_db()
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+
+        # Insert new batch, or add the weights to it if the LOT already exists
+        # (same product, same day, same level). The write lock is held from
+        # the existence check through the upsert, so the check stays true.
+        created = cur.execute(_SQL_ROAST_LOT_EXISTS, (lot_number,)).fetchone() is None
+        cur.execute(_SQL_UPSERT_ROAST_BATCH, (
+            lot_number, product_id, roast_date.isoformat(), roast_level, day_seq,
+            green_weight, roasted_weight, roasted_weight, weight_loss,
+            roasttime_uid, preheat, charge_temp, fc_time, fc_temp,
+            drop_temp, total_time, ambient, humidity, notes
+        )).fetchone()
+
+        conn.commit()
+        conn.close()
+
+        if created:
             flash(f'Created new batch: {lot_number}', 'success')
+        else:
+            flash(f'Added to existing batch {lot_number}', 'success')
 
         return redirect(url_for('roast_tracker.dashboard'))
 
@@ -229,15 +420,8 @@ def new_roast():
         ORDER BY gc.country, cp.name
     """)
 
-    # Get unique countries for filter
-    countries = query_db("""
-        SELECT DISTINCT gc.country
-        FROM coffee_products cp
-        LEFT JOIN green_coffee gc ON cp.green_coffee_id = gc.id
-        WHERE cp.is_active = 1 AND COALESCE(cp.is_archived, 0) = 0 AND gc.country IS NOT NULL
-        ORDER BY gc.country
-    """)
-    country_list = [c['country'] for c in countries if c['country']]
+    # Unique countries for filter (same rows, no second query)
+    country_list = sorted({p['country'] for p in products if p['country']})
 
     # Get recent RoastTime imports for selection
     roasttime_roasts = load_all_roasts()[:50]  # Last 50 roasts
@@ -250,6 +434,18 @@ def new_roast():
                            today=date.today().isoformat())
 
 
+# Packaged production types -> grams per package
+PACKAGE_SIZES = {
+    'whole_bean_16': 16,
+    'whole_bean_70': 70,
+    'whole_bean_250': 250,
+    'drip_11': 11,
+}
+
+# Production types where the coffee used is entered as a custom weight
+CUSTOM_WEIGHT_TYPES = frozenset(('cold_brew', 'market', 'sampling'))
+
+
 @roast_tracker.route('/production', methods=['GET', 'POST'])
 @tracker_login_required
 def production():
@@ -272,18 +468,10 @@ def production():
             return redirect(url_for('roast_tracker.production'))
 
         # Determine package size and total coffee needed
-        package_sizes = {
-            'whole_bean_16': 16,
-            'whole_bean_70': 70,
-            'whole_bean_250': 250,
-            'drip_11': 11,
-        }
-
-        if production_type in package_sizes:
-            package_size = package_sizes[production_type]
+        package_size = PACKAGE_SIZES.get(production_type)
+        if package_size is not None:
             total_needed = package_size * quantity
-        elif production_type in ('cold_brew', 'market', 'sampling'):
-            package_size = None
+        elif production_type in CUSTOM_WEIGHT_TYPES:
             total_needed = custom_weight or 0
         else:
             flash('Invalid production type', 'error')
@@ -304,9 +492,10 @@ def production():
             # Whole bean uses same LOT as roast
             prod_lot = batch['lot_number']
 
-        # Create production batch
+        # Create production batch (all three writes in one transaction / one sync)
         conn = get_db()
         cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
 
         cur.execute("""
             INSERT INTO production_batches (
@@ -318,17 +507,10 @@ def production():
         prod_batch_id = cur.lastrowid
 
         # Link to source roast
-        cur.execute("""
-            INSERT INTO production_sources (production_batch_id, roast_batch_id, weight_used_g)
-            VALUES (?, ?, ?)
-        """, (prod_batch_id, roast_batch_id, total_needed))
+        cur.execute(_SQL_INSERT_PRODUCTION_SOURCE, (prod_batch_id, roast_batch_id, total_needed))
 
         # Deduct from available stock
-        cur.execute("""
-            UPDATE roast_batches
-            SET available_weight_g = available_weight_g - ?
-            WHERE id = ?
-        """, (total_needed, roast_batch_id))
+        cur.execute(_SQL_DEDUCT_ROAST_BATCH, (total_needed, roast_batch_id))
 
         conn.commit()
         conn.close()
@@ -338,21 +520,16 @@ def production():
 
     # GET: Show production form
     # Get batches with available stock, sorted by country then roast level (V=light, K=medium, S=dark)
-    batches = query_db("""
+    batches = _stock_cached_rows('production_batches', lambda: query_db(f"""
         SELECT rb.*, cp.name as product_name, cp.roast_level, gc.country
         FROM roast_batches rb
         JOIN coffee_products cp ON rb.product_id = cp.id
         LEFT JOIN green_coffee gc ON cp.green_coffee_id = gc.id
         WHERE rb.available_weight_g > 0
         ORDER BY gc.country,
-                 CASE cp.roast_level
-                     WHEN 'V' THEN 1
-                     WHEN 'K' THEN 2
-                     WHEN 'S' THEN 3
-                     ELSE 4
-                 END,
+                 {_SQL_ROAST_LEVEL_SORT},
                  rb.roast_date DESC
-    """)
+    """))
 
     return render_template('roast_tracker/production.html',
                            batches=batches,
@@ -365,57 +542,51 @@ def advent_calendar():
     """Advent calendar production - 4 light roasts + 4 medium roasts"""
     if request.method == 'POST':
         advent_date_str = request.form.get('advent_date')
-        advent_date = datetime.strptime(advent_date_str, '%Y-%m-%d').date()
+        try:
+            advent_date = _fast_iso_date(advent_date_str)
+        except (TypeError, ValueError):
+            flash('Invalid advent calendar date', 'error')
+            return redirect(url_for('roast_tracker.advent_calendar'))
         calendar_year = advent_date.year
 
         # Generate advent LOT
         advent_lot = generate_advent_lot(advent_date)
 
+        # 4 light roast selections, then 4 medium roast selections
+        slots = [
+            (request.form.get(f'{kind}_{i}_batch', type=int),
+             request.form.get(f'{kind}_{i}_weight', type=float, default=0))
+            for kind in ('light', 'medium') for i in range(1, 5)
+        ]
+        slots = [(batch_id, weight) for batch_id, weight in slots if batch_id and weight > 0]
+
         conn = get_db()
         cur = conn.cursor()
-
+        # Take the write lock up front so the availability check and the
+        # decrements below can't interleave with another submission
+        cur.execute("BEGIN IMMEDIATE")
+
+        # Fetch availability for all selected batches in one query
+        available = {}
+        batch_ids = list({batch_id for batch_id, _ in slots})
+        if batch_ids:
+            placeholders = ','.join('?' * len(batch_ids))
+            cur.execute(f"SELECT id, available_weight_g FROM roast_batches WHERE id IN ({placeholders})",
+                        batch_ids)
+            available = {row['id']: row['available_weight_g'] for row in cur.fetchall()}
+
+        inserts = []
+        updates = []
         total_used = 0
-        slot_number = 0
-
-        # Process 4 light roast selections
-        for i in range(1, 5):
-            batch_id = request.form.get(f'light_{i}_batch', type=int)
-            weight = request.form.get(f'light_{i}_weight', type=float, default=0)
-
-            if batch_id and weight > 0:
-                batch = query_db("SELECT * FROM roast_batches WHERE id = ?", (batch_id,), one=True)
-                if batch and batch['available_weight_g'] >= weight:
-                    slot_number += 1
-                    cur.execute("""
-                        INSERT INTO advent_calendar_contents (advent_lot, calendar_year, day_number, roast_batch_id, weight_g)
-                        VALUES (?, ?, ?, ?, ?)
-                    """, (advent_lot, calendar_year, slot_number, batch_id, weight))
-
-                    cur.execute("""
-                        UPDATE roast_batches SET available_weight_g = available_weight_g - ? WHERE id = ?
-                    """, (weight, batch_id))
-
-                    total_used += weight
-
-        # Process 4 medium roast selections
-        for i in range(1, 5):
-            batch_id = request.form.get(f'medium_{i}_batch', type=int)
-            weight = request.form.get(f'medium_{i}_weight', type=float, default=0)
-
-            if batch_id and weight > 0:
-                batch = query_db("SELECT * FROM roast_batches WHERE id = ?", (batch_id,), one=True)
-                if batch and batch['available_weight_g'] >= weight:
-                    slot_number += 1
-                    cur.execute("""
-                        INSERT INTO advent_calendar_contents (advent_lot, calendar_year, day_number, roast_batch_id, weight_g)
-                        VALUES (?, ?, ?, ?, ?)
-                    """, (advent_lot, calendar_year, slot_number, batch_id, weight))
-
-                    cur.execute("""
-                        UPDATE roast_batches SET available_weight_g = available_weight_g - ? WHERE id = ?
-                    """, (weight, batch_id))
-
-                    total_used += weight
+        for batch_id, weight in slots:
+            if batch_id in available and available[batch_id] >= weight:
+                available[batch_id] -= weight
+                inserts.append((advent_lot, calendar_year, len(inserts) + 1, batch_id, weight))
+                updates.append((weight, batch_id))
+                total_used += weight
+
+        cur.executemany(_SQL_INSERT_ADVENT_CONTENT, inserts)
+        cur.executemany(_SQL_DEDUCT_ROAST_BATCH, updates)
 
         # Create production batch entry
         cur.execute("""
@@ -463,28 +634,17 @@ def advent_calendar():
 @tracker_login_required
 def inventory():
     """Full inventory view"""
-    # All batches
-    batches = query_db("""
-        SELECT rb.*, cp.name as product_name, gc.country,
-               (rb.roasted_weight_g - rb.available_weight_g) as used_weight_g
-        FROM roast_batches rb
-        JOIN coffee_products cp ON rb.product_id = cp.id
-        LEFT JOIN green_coffee gc ON cp.green_coffee_id = gc.id
-        ORDER BY rb.roast_date DESC
-    """)
-
-    # Production history
-    production = query_db("""
-        SELECT pb.*, GROUP_CONCAT(rb.lot_number) as source_lots
+    # The full batch history lives on roast_history(); this page only lists
+    # in-stock batches per product
+    production, packed_products, products, in_stock_batches = query_many(
+        # Production history
+        f"""
+        SELECT pb.*, {_SQL_SOURCE_LOTS} as source_lots
         FROM production_batches pb
-        LEFT JOIN production_sources ps ON pb.id = ps.production_batch_id
-        LEFT JOIN roast_batches rb ON ps.roast_batch_id = rb.id
-        GROUP BY pb.id
-        ORDER BY pb.production_date DESC
-    """)
-
-    # Packed products (ready to ship) - only show items with quantity > 0
-    packed_products = query_db("""
+        ORDER BY pb.production_date DESC, pb.id
+    """,
+        # Packed products (ready to ship) - only show items with quantity > 0
+        f"""
         SELECT pb.id, pb.production_lot, pb.production_type, pb.package_size_g,
                pb.quantity, pb.production_date,
                rb.lot_number as source_lot, rb.roast_date,
@@ -495,36 +655,44 @@ def inventory():
         JOIN coffee_products cp ON rb.product_id = cp.id
         LEFT JOIN green_coffee gc ON cp.green_coffee_id = gc.id
         WHERE pb.quantity > 0
-          AND pb.production_type IN ('whole_bean_250', 'whole_bean_70', 'whole_bean_16', 'drip_11')
+          AND pb.production_type IN ({PACKED_TYPES_SQL})
         ORDER BY cp.name, pb.package_size_g DESC, pb.production_date DESC
-    """)
-
-    # All coffee products (offerings) with inventory summary
-    # Exclude archived products from inventory view
-    products = query_db("""
+    """,
+        # All coffee products (offerings) with inventory summary
+        # Exclude archived products from inventory view
+        """
         SELECT cp.*, gc.country, gc.name as green_name,
-               COALESCE(SUM(rb.available_weight_g), 0) as total_available_g,
-               COUNT(rb.id) as batch_count
+               COALESCE(rb.total_available_g, 0) as total_available_g,
+               COALESCE(rb.batch_count, 0) as batch_count
         FROM coffee_products cp
         LEFT JOIN green_coffee gc ON cp.green_coffee_id = gc.id
-        LEFT JOIN roast_batches rb ON cp.id = rb.product_id AND rb.available_weight_g > 0
+        LEFT JOIN (
+            SELECT product_id, SUM(available_weight_g) as total_available_g,
+                   COUNT(*) as batch_count
+            FROM roast_batches
+            WHERE available_weight_g > 0
+            GROUP BY product_id
+        ) rb ON rb.product_id = cp.id
         WHERE cp.is_active = 1 AND COALESCE(cp.is_archived, 0) = 0
-        GROUP BY cp.id
         ORDER BY gc.country, cp.name
-    """)
+    """,
+        # In-stock batches (LOTs) of those products, for display in cards
+        """
+        SELECT product_id, id, lot_number, available_weight_g, roast_date
+        FROM roast_batches
+        WHERE available_weight_g > 0
+          AND product_id IN (SELECT id FROM coffee_products
+                             WHERE is_active = 1 AND COALESCE(is_archived, 0) = 0)
+        ORDER BY product_id, roast_date DESC
+    """,
+    )
 
-    # Get batches (LOTs) per product for display in cards
-    product_batches = {}
-    for product in products:
-        product_batches[product['id']] = query_db("""
-            SELECT id, lot_number, available_weight_g, roast_date
-            FROM roast_batches
-            WHERE product_id = ? AND available_weight_g > 0
-            ORDER BY roast_date DESC
-        """, (product['id'],))
+    # Bucket batches per product (newest first, as fetched)
+    product_batches = {product['id']: [] for product in products}
+    for batch in in_stock_batches:
+        product_batches[batch['product_id']].append(batch)
 
     return render_template('roast_tracker/inventory.html',
-                           batches=batches,
                            production=production,
                            packed_products=packed_products,
                            products=products,
@@ -537,31 +705,32 @@ def inventory():
 @tracker_login_required
 def roast_history():
     """View all roast batches history"""
-    # All batches
-    batches = query_db("""
+    batches, totals = query_many(
+        # All batches
+        """
         SELECT rb.*, cp.name as product_name, gc.country,
                (rb.roasted_weight_g - rb.available_weight_g) as used_weight_g
         FROM roast_batches rb
         JOIN coffee_products cp ON rb.product_id = cp.id
         LEFT JOIN green_coffee gc ON cp.green_coffee_id = gc.id
         ORDER BY rb.roast_date DESC
-    """)
-
-    # Get unique countries for filter
-    countries = query_db("""
-        SELECT DISTINCT gc.country
+    """,
+        # Totals over the same rows
+        """
+        SELECT COALESCE(SUM(rb.roasted_weight_g), 0) as total_roasted_g,
+               COALESCE(SUM(rb.available_weight_g), 0) as total_available_g,
+               COALESCE(SUM(rb.roasted_weight_g - rb.available_weight_g), 0) as total_used_g
         FROM roast_batches rb
         JOIN coffee_products cp ON rb.product_id = cp.id
-        LEFT JOIN green_coffee gc ON cp.green_coffee_id = gc.id
-        WHERE gc.country IS NOT NULL
-        ORDER BY gc.country
-    """)
-    country_list = [c['country'] for c in countries if c['country']]
+    """,
+    )
 
-    # Calculate totals
-    total_roasted = sum(b['roasted_weight_g'] for b in batches) if batches else 0
-    total_available = sum(b['available_weight_g'] for b in batches) if batches else 0
-    total_used = sum(b['used_weight_g'] for b in batches) if batches else 0
+    # Unique countries for filter, taken from the batch rows (same joins)
+    country_list = sorted({b['country'] for b in batches if b['country']})
+
+    total_roasted = totals[0]['total_roasted_g']
+    total_available = totals[0]['total_available_g']
+    total_used = totals[0]['total_used_g']
 
     return render_template('roast_tracker/roast_history.html',
                            batches=batches,
@@ -576,26 +745,41 @@ def roast_history():
 @tracker_login_required
 def batch_detail(batch_id):
     """View details of a roast batch"""
-    batch = query_db("""
-        SELECT rb.*, cp.name as product_name, gc.country, gc.process, gc.tasting_notes
+    # Batch plus its production in one query: one row per production batch
+    # (or a single row with NULL pb_ columns if nothing was produced yet)
+    rows = query_db("""
+        SELECT rb.*, cp.name as product_name, gc.country, gc.process, gc.tasting_notes,
+               pb.id as pb_id, pb.production_lot as pb_production_lot,
+               pb.production_type as pb_production_type,
+               pb.package_size_g as pb_package_size_g, pb.quantity as pb_quantity,
+               pb.total_coffee_used_g as pb_total_coffee_used_g,
+               pb.production_date as pb_production_date, pb.notes as pb_notes
         FROM roast_batches rb
         JOIN coffee_products cp ON rb.product_id = cp.id
         LEFT JOIN green_coffee gc ON cp.green_coffee_id = gc.id
+        LEFT JOIN production_sources ps ON ps.roast_batch_id = rb.id
+        LEFT JOIN production_batches pb ON pb.id = ps.production_batch_id
         WHERE rb.id = ?
-    """, (batch_id,), one=True)
+        ORDER BY pb.production_date DESC
+    """, (batch_id,))
 
-    if not batch:
+    if not rows:
         flash('Batch not found', 'error')
         return redirect(url_for('roast_tracker.inventory'))
 
+    batch = rows[0]
+
     # Production from this batch
-    production = query_db("""
-        SELECT pb.*
-        FROM production_batches pb
-        JOIN production_sources ps ON pb.id = ps.production_batch_id
-        WHERE ps.roast_batch_id = ?
-        ORDER BY pb.production_date DESC
-    """, (batch_id,))
+    production = [{
+        'id': row['pb_id'],
+        'production_lot': row['pb_production_lot'],
+        'production_type': row['pb_production_type'],
+        'package_size_g': row['pb_package_size_g'],
+        'quantity': row['pb_quantity'],
+        'total_coffee_used_g': row['pb_total_coffee_used_g'],
+        'production_date': row['pb_production_date'],
+        'notes': row['pb_notes'],
+    } for row in rows if row['pb_id'] is not None]
 
     # RoastTime data if available
     roasttime_data = None
@@ -615,36 +799,56 @@ def batch_detail(batch_id):
 @tracker_login_required
 def api_batches():
     """API: Get all batches with stock"""
-    batches = query_db("""
+    return _stock_cached_json('batches', lambda: query_db("""
         SELECT rb.*, cp.name as product_name, gc.country
         FROM roast_batches rb
         JOIN coffee_products cp ON rb.product_id = cp.id
         LEFT JOIN green_coffee gc ON cp.green_coffee_id = gc.id
         WHERE rb.available_weight_g > 0
         ORDER BY rb.roast_date DESC
-    """)
-    return jsonify([dict(b) for b in batches])
+    """))
+
+
+# Upper bound for /api/roasttime?limit=
+ROASTTIME_API_MAX_LIMIT = 500
+
+# Serialized /api/roasttime bodies: limit -> (version, body bytes)
+_roasttime_response_cache = {}
 
 
 @roast_tracker.route('/api/roasttime')
 @tracker_login_required
 def api_roasttime():
     """API: Get RoastTime roasts for import"""
-    limit = request.args.get('limit', 50, type=int)
-    roasts = load_all_roasts()[:limit]
+    limit = min(max(request.args.get('limit', 50, type=int), 0), ROASTTIME_API_MAX_LIMIT)
+
+    # Rebuilt only when the RoastTime folder changed (see roast_list_version)
+    version = ('roasttime', roast_list_version(), limit)
+    not_modified = _versioned_json(None, version)
+    if not_modified:
+        return not_modified
+    cached = _roasttime_response_cache.get(limit)
+    if cached and cached[0] == version:
+        return _versioned_json(cached[1], version)
+
+    # Both lists are cached and parallel; walk the first `limit` without copying
+    roasts = islice(load_all_roasts(), limit)
+    levels = guess_roast_levels()
 
     # Simplify for JSON
-    return jsonify([{
+    body = jsonify_fast([{
         'uid': r['roasttime_uid'],
         'name': r['roast_name'],
-        'date': r['roast_date'].isoformat() if r['roast_date'] else None,
+        'date': r['roast_date'],
         'green_weight_g': r['green_weight_g'],
         'roasted_weight_g': r['roasted_weight_g'],
         'weight_loss_percent': r['weight_loss_percent'],
         'drop_temp': r['drop_temp'],
         'total_roast_time': r['total_roast_time'],
-        'guessed_level': guess_roast_level(r)
-    } for r in roasts])
+        'guessed_level': level
+    } for r, level in zip(roasts, levels)]).get_data()
+    _roasttime_response_cache[limit] = (version, body)
+    return _versioned_json(body, version)
 
 
 @roast_tracker.route('/api/generate-lot', methods=['POST'])
@@ -659,7 +863,10 @@ def api_generate_lot():
     product_id = data.get('product_id')
     custom_sequence = data.get('custom_sequence')
 
-    roast_date = datetime.strptime(roast_date_str, '%Y-%m-%d').date()
+    try:
+        roast_date = _fast_iso_date(roast_date_str)
+    except (TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': 'Invalid roast_date'}), 400
 
     # Get the next sequence for display
     next_sequence = get_next_sequence(roast_level, roast_date)
@@ -670,7 +877,7 @@ def api_generate_lot():
     else:
         lot = generate_roast_lot(roast_level, roast_date, product_id)
 
-    return jsonify({
+    return jsonify_fast({
         'lot_number': lot,
         'next_sequence': next_sequence,
         'date_part': format_date_part(roast_date)
@@ -776,7 +983,7 @@ def api_get_green_coffee(coffee_id):
     """API: Get green coffee details"""
     coffee = query_db("SELECT * FROM green_coffee WHERE id = ?", (coffee_id,), one=True)
     if coffee:
-        return jsonify(dict(coffee))
+        return jsonify_fast(coffee)
     return jsonify({'error': 'Not found'}), 404
 
 
@@ -786,7 +993,7 @@ def api_get_product(product_id):
     """API: Get product details"""
     product = query_db("SELECT * FROM coffee_products WHERE id = ?", (product_id,), one=True)
     if product:
-        return jsonify(dict(product))
+        return jsonify_fast(product)
     return jsonify({'error': 'Not found'}), 404
 
 
@@ -808,36 +1015,98 @@ def unarchive_product(product_id):
 
 # ===== Orders & Fulfillment =====
 
+# WooCommerce REST caps per_page at 100
+WC_MAX_PER_PAGE = 100
+
+# app.py imports this blueprint before defining its WooCommerce helpers and
+# Billingo settings, so the app module is resolved once, on first use
+_app_module = None
+
+
+def _app():
+    """The app module (imported lazily to avoid a circular import)"""
+    global _app_module
+    if _app_module is None:
+        import app as app_module
+        _app_module = app_module
+    return _app_module
+
+
+def _app_settings(*names):
+    """Module-level settings from app.py, e.g. the Billingo API credentials"""
+    app_module = _app()
+    return tuple(getattr(app_module, name) for name in names)
+
+
+# WooCommerce order lists are reused this long by the orders page and order
+# analysis, instead of paging through the REST API each time. Invoicing
+# always asks the API directly, so it never bills from a stale order.
+WC_ORDERS_TTL_SECONDS = 30
+
+# (status, per_page) -> (fetched at, orders)
+_wc_orders_cache = {}
+
+
+def fetch_wc_orders(status='processing', per_page=100):
+    """
+    Call app.fetch_wc_orders, reusing the result for WC_ORDERS_TTL_SECONDS.
+
+    Callers annotate the returned orders in place, so each gets its own copy.
+    Empty results (which is also what an API error gives) are not cached.
+    """
+    key = (status, per_page)
+    cached = _wc_orders_cache.get(key)
+    if cached and time.monotonic() - cached[0] < WC_ORDERS_TTL_SECONDS:
+        return copy.deepcopy(cached[1])
+
+    orders = _app().fetch_wc_orders(status=status, per_page=per_page)
+    if orders:
+        _wc_orders_cache[key] = (time.monotonic(), copy.deepcopy(orders))
+    return orders
+
+
+def wc_api_request(*args, **kwargs):
+    """Call app.wc_api_request"""
+    return _app().wc_api_request(*args, **kwargs)
+
+
 @roast_tracker.route('/orders')
 @tracker_login_required
 def orders():
     """View WooCommerce orders and fulfillment status"""
-    import sys
-    sys.path.insert(0, '..')
-    from app import fetch_wc_orders
-
     # Fetch processing orders from WooCommerce
     wc_orders = fetch_wc_orders(status='processing')
 
-    # Fetch B2B orders that are pending/processing (not completed/cancelled)
-    b2b_orders_raw = query_db("""
+    b2b_orders_raw, b2b_items = query_many(
+        # B2B orders that are pending/processing (not completed/cancelled)
+        """
         SELECT o.*, c.company_name
         FROM b2b_orders o
         JOIN b2b_customers c ON o.customer_id = c.id
         WHERE o.status IN ('pending', 'processing', 'ready')
         ORDER BY o.order_date DESC
-    """)
+    """,
+        # ...and the items of all of them
+        """
+        SELECT i.*
+        FROM b2b_order_items i
+        JOIN b2b_orders o ON i.order_id = o.id
+        JOIN b2b_customers c ON o.customer_id = c.id
+        WHERE o.status IN ('pending', 'processing', 'ready')
+        ORDER BY i.order_id, i.id
+    """,
+    )
+
+    # Bucket items per order (in id order, as fetched)
+    items_by_order = {order['id']: [] for order in b2b_orders_raw}
+    for item in b2b_items:
+        items_by_order[item['order_id']].append(item)
 
     # Convert B2B orders to a format similar to WooCommerce orders
     b2b_orders = []
     for order in b2b_orders_raw:
-        # Get order items
-        items = query_db("""
-            SELECT * FROM b2b_order_items WHERE order_id = ? ORDER BY id
-        """, (order['id'],))
-
         line_items = []
-        for item in items:
+        for item in items_by_order[order['id']]:
             line_items.append({
                 'id': item['id'],
                 'name': item['product_name'],
@@ -868,53 +1137,68 @@ def orders():
             'missing_items': []
         })
 
-    # Get available packaged products
-    packaged = query_db("""
-        SELECT
-            pb.id, pb.production_lot, pb.production_type, pb.package_size_g, pb.quantity,
-            rb.lot_number, rb.roast_level,
-            cp.name as product_name, gc.country
+    # Available stock per product name (for fulfillment analysis). An item is
+    # coverable if any single packaged batch / roast batch has enough, so
+    # only the largest one per product matters. Both sides come back from
+    # one statement, told apart by the kind column.
+    stock_rows = query_db(f"""
+        SELECT 'packaged' as kind, cp.name as product_name, MAX(pb.quantity) as max_amount
         FROM production_batches pb
         JOIN production_sources ps ON pb.id = ps.production_batch_id
         JOIN roast_batches rb ON ps.roast_batch_id = rb.id
         JOIN coffee_products cp ON rb.product_id = cp.id
-        LEFT JOIN green_coffee gc ON cp.green_coffee_id = gc.id
-        WHERE pb.production_type IN ('whole_bean_250', 'whole_bean_70', 'whole_bean_16', 'drip_11')
+        WHERE pb.production_type IN ({PACKED_TYPES_SQL})
           AND pb.quantity > 0
-        ORDER BY cp.name, pb.package_size_g DESC
-    """)
-
-    # Get available roasted coffee (for fulfillment analysis)
-    roasted = query_db("""
-        SELECT rb.*, cp.name as product_name, gc.country
+        GROUP BY cp.name
+        UNION ALL
+        SELECT 'roasted' as kind, cp.name as product_name, MAX(rb.available_weight_g) as max_amount
         FROM roast_batches rb
         JOIN coffee_products cp ON rb.product_id = cp.id
-        LEFT JOIN green_coffee gc ON cp.green_coffee_id = gc.id
         WHERE rb.available_weight_g > 0
-        ORDER BY cp.name, rb.roast_date DESC
+        GROUP BY cp.name
     """)
 
     # Get all LOT assignments to check which order items are already fulfilled
     lot_assignments = query_db("""
-        SELECT wc_order_id, wc_order_item_id, COUNT(*) as assigned_slots
+        SELECT CAST(wc_order_id AS TEXT) as wc_order_id, wc_order_item_id,
+               COUNT(*) as assigned_slots
         FROM order_lot_assignments
-        GROUP BY wc_order_id, wc_order_item_id
+        GROUP BY 1, wc_order_item_id
     """)
     # Build a dict: (order_id, item_id) -> assigned_slots
-    # Note: wc_order_id can be numeric (WC orders) or string "B2B-x" (B2B orders)
-    assignments_by_item = {}
-    for a in lot_assignments:
-        # Store with both possible key types for numeric IDs (int and str)
-        order_id = a['wc_order_id']
-        item_id = a['wc_order_item_id']
-        assignments_by_item[(order_id, item_id)] = a['assigned_slots']
-        # Also store string version of numeric IDs for consistent lookup
-        if isinstance(order_id, int):
-            assignments_by_item[(str(order_id), item_id)] = a['assigned_slots']
+    # Note: wc_order_id can be numeric (WC orders) or string "B2B-x" (B2B orders),
+    # so order IDs are compared as text on both sides
+    assignments_by_item = {
+        (a['wc_order_id'], a['wc_order_item_id']): a['assigned_slots']
+        for a in lot_assignments
+    }
+
+    # Key by lowercased name in Python (SQLite's LOWER() is ASCII-only)
+    max_packaged_qty = {}
+    max_roasted_g = {}
+    for row in stock_rows:
+        stock = max_packaged_qty if row['kind'] == 'packaged' else max_roasted_g
+        name = row['product_name'].lower()
+        stock[name] = max(stock.get(name, 0), row['max_amount'])
+
+    # Substring name matches, computed once per distinct line item name
+    packaged_matches = {}
+    roasted_matches = {}
+
+    def matching_names(item_name, stock_names, memo):
+        if item_name not in memo:
+            memo[item_name] = [
+                name for name in stock_names if name in item_name or item_name in name
+            ]
+        return memo[item_name]
 
     # Combine WC orders and B2B orders
     all_orders = wc_orders + b2b_orders
 
+    # Order summary - aggregate quantities per product (with 500g=2x250g logic),
+    # collected in the same pass as the fulfillment analysis
+    order_summary = {}
+
     # Analyze fulfillment for each order
     for order in all_orders:
         order['fulfillment_status'] = 'ready'  # Default
@@ -925,8 +1209,8 @@ def orders():
             item_name = item['name'].lower()
             item_qty = item['quantity']
 
-            # Calculate how many LOT slots are needed for this item
-            # For B2B, use package_size_g; for WC, check the name
+            # Calculate how many LOT slots (250g units) are needed for this item
+            # For B2B, use package_size_g; for WC, check the name (500g = 2x250g)
             if is_b2b:
                 package_size = item.get('package_size_g', 250)
                 slots_needed = (package_size // 250) * item_qty
@@ -935,8 +1219,14 @@ def orders():
             else:
                 slots_needed = item_qty
 
-            # Use order['id'] directly - for B2B it's already "B2B-x", for WC it's numeric
-            lookup_key = (order['id'], item['id'])
+            summary = order_summary.get(item['name'])
+            if summary is None:
+                summary = order_summary[item['name']] = {'total_qty': 0, 'total_250g': 0}
+            summary['total_qty'] += item_qty
+            summary['total_250g'] += slots_needed
+
+            # For B2B order['id'] is already "B2B-x", for WC it's numeric
+            lookup_key = (str(order['id']), item['id'])
 
             # Check if LOT assignments already exist for this item
             assigned_slots = assignments_by_item.get(lookup_key, 0)
@@ -946,57 +1236,27 @@ def orders():
                 continue
 
             # Check if we have packaged product
-            found_package = False
-            for pkg in packaged:
-                pkg_name = pkg['product_name'].lower()
-                if pkg_name in item_name or item_name in pkg_name:
-                    if pkg['quantity'] >= item_qty:
-                        found_package = True
-                        item['fulfillment'] = 'packaged'
-                        break
-
-            if not found_package:
+            found_package = any(
+                max_packaged_qty[name] >= item_qty
+                for name in matching_names(item_name, max_packaged_qty, packaged_matches)
+            )
+            if found_package:
+                item['fulfillment'] = 'packaged'
+            else:
                 # Check if we have roasted coffee to package
-                found_roasted = False
-                for rb in roasted:
-                    rb_name = rb['product_name'].lower()
-                    if rb_name in item_name or item_name in rb_name:
-                        # Estimate weight needed (250g default)
-                        weight_needed = item_qty * 250
-                        if rb['available_weight_g'] >= weight_needed:
-                            found_roasted = True
-                            item['fulfillment'] = 'needs_packaging'
-                            break
-
-                if not found_roasted:
+                # Estimate weight needed (250g default)
+                weight_needed = item_qty * 250
+                found_roasted = any(
+                    max_roasted_g[name] >= weight_needed
+                    for name in matching_names(item_name, max_roasted_g, roasted_matches)
+                )
+                if found_roasted:
+                    item['fulfillment'] = 'needs_packaging'
+                else:
                     item['fulfillment'] = 'needs_roasting'
                     order['fulfillment_status'] = 'incomplete'
                     order['missing_items'].append(item['name'])
 
-    # Calculate order summary - aggregate quantities per product (with 500g=2x250g logic)
-    order_summary = {}
-    for order in all_orders:
-        is_b2b = order.get('is_b2b', False)
-        for item in order['line_items']:
-            item_name = item['name']
-            item_qty = item['quantity']
-
-            # Determine unit size from item - B2B has package_size_g, WC uses name
-            if is_b2b:
-                package_size = item.get('package_size_g', 250)
-                unit_250g = (package_size // 250) * item_qty
-            elif '500' in item_name:
-                # 500g = 2x250g
-                unit_250g = 2 * item_qty
-            else:
-                # Default 250g
-                unit_250g = item_qty
-
-            if item_name not in order_summary:
-                order_summary[item_name] = {'total_qty': 0, 'total_250g': 0}
-            order_summary[item_name]['total_qty'] += item_qty
-            order_summary[item_name]['total_250g'] += unit_250g
-
     # Format summary for display (e.g., "4x250g")
     order_summary_formatted = []
     for name, data in sorted(order_summary.items()):
@@ -1008,14 +1268,20 @@ def orders():
                 'total_g': qty_250g * 250
             })
 
-    # Get WC invoices for all orders
-    wc_invoices_list = query_db("SELECT wc_order_id, billingo_document_id as document_id FROM wc_order_invoices")
-    wc_invoices = {str(inv['wc_order_id']): inv for inv in wc_invoices_list}
+    # Get WC invoices for the WC orders on this page (not the whole table)
+    wc_order_ids = [order['id'] for order in wc_orders]
+    wc_invoices = {}
+    if wc_order_ids:
+        placeholders = ','.join('?' * len(wc_order_ids))
+        wc_invoices_list = query_db(f"""
+            SELECT wc_order_id, billingo_document_id as document_id
+            FROM wc_order_invoices
+            WHERE wc_order_id IN ({placeholders})
+        """, wc_order_ids)
+        wc_invoices = {str(inv['wc_order_id']): inv for inv in wc_invoices_list}
 
     return render_template('roast_tracker/orders.html',
                            orders=all_orders,
-                           packaged=packaged,
-                           roasted=roasted,
                            order_summary=order_summary_formatted,
                            wc_invoices=wc_invoices)
 
@@ -1027,26 +1293,20 @@ def advent_config():
     if request.method == 'POST':
         conn = get_db()
         cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
 
         # Clear existing config
         cur.execute("DELETE FROM advent_calendar_config")
 
-        # Save new config
-        for i in range(1, 5):
-            light_product_id = request.form.get(f'light_{i}', type=int)
-            medium_product_id = request.form.get(f'medium_{i}', type=int)
-
-            if light_product_id:
-                cur.execute("""
-                    INSERT INTO advent_calendar_config (slot_number, roast_type, product_id)
-                    VALUES (?, 'light', ?)
-                """, (i, light_product_id))
-
-            if medium_product_id:
-                cur.execute("""
-                    INSERT INTO advent_calendar_config (slot_number, roast_type, product_id)
-                    VALUES (?, 'medium', ?)
-                """, (i, medium_product_id))
+        # Save new config (empty slots stay cleared)
+        slots = [
+            (i, roast_type, request.form.get(f'{roast_type}_{i}', type=int))
+            for i in range(1, 5) for roast_type in ('light', 'medium')
+        ]
+        cur.executemany("""
+            INSERT INTO advent_calendar_config (slot_number, roast_type, product_id)
+            VALUES (?, ?, ?)
+        """, [slot for slot in slots if slot[2]])
 
         conn.commit()
         conn.close()
@@ -1054,30 +1314,33 @@ def advent_config():
         return redirect(url_for('roast_tracker.advent_config'))
 
     # GET: Show config form
-    # Get all light roast products
-    light_products = query_db("""
+    # Product lists and the current config (with each product's roasted stock)
+    # are read in one transaction on one cursor
+    light_products, medium_products, current_config = query_many(
+        # All light roast products
+        """
         SELECT cp.*, gc.country
         FROM coffee_products cp
         LEFT JOIN green_coffee gc ON cp.green_coffee_id = gc.id
         WHERE cp.roast_level = 'V' AND cp.is_active = 1
         ORDER BY gc.country, cp.name
-    """)
-
-    # Get all medium roast products
-    medium_products = query_db("""
+    """,
+        # All medium roast products
+        """
         SELECT cp.*, gc.country
         FROM coffee_products cp
         LEFT JOIN green_coffee gc ON cp.green_coffee_id = gc.id
         WHERE cp.roast_level = 'K' AND cp.is_active = 1
         ORDER BY gc.country, cp.name
-    """)
-
-    # Get current config
-    current_config = query_db("""
-        SELECT ac.*, cp.name as product_name, gc.country
+    """,
+        # Current config with each product's in-stock roasted weight
+        """
+        SELECT ac.*, cp.name as product_name, gc.country,
+               COALESCE(pst.in_stock_g, 0) as total_available
         FROM advent_calendar_config ac
         JOIN coffee_products cp ON ac.product_id = cp.id
         LEFT JOIN green_coffee gc ON cp.green_coffee_id = gc.id
+        LEFT JOIN product_stock pst ON pst.product_id = ac.product_id
         WHERE ac.is_active = 1
         ORDER BY ac.roast_type, ac.slot_number
     """)
@@ -1091,13 +1354,7 @@ def advent_config():
     inventory_status = {}
     for cfg in current_config:
         # Check if we have 48g+ of roasted coffee
-        roasted = query_db("""
-            SELECT SUM(available_weight_g) as total
-            FROM roast_batches
-            WHERE product_id = ? AND available_weight_g > 0
-        """, (cfg['product_id'],), one=True)
-
-        total_available = roasted['total'] if roasted and roasted['total'] else 0
+        total_available = cfg['total_available']
         # Use string keys for JSON compatibility
         inventory_status[str(cfg['product_id'])] = {
             'product_name': cfg['product_name'],
@@ -1206,7 +1463,10 @@ def api_preview_plan_lot():
     # Parse roast date
     from datetime import date
     if roast_date_str:
-        roast_date = datetime.strptime(roast_date_str, '%Y-%m-%d').date()
+        try:
+            roast_date = _fast_iso_date(roast_date_str)
+        except (TypeError, ValueError):
+            return jsonify({'status': 'error', 'message': 'Invalid roast_date'}), 400
     else:
         roast_date = date.today()
 
@@ -1256,7 +1516,10 @@ def api_complete_plan_with_roast():
         return jsonify({'status': 'error', 'message': 'Plan is not in planned status'}), 400
 
     # Parse roast date
-    roast_date = datetime.strptime(roast_date_str, '%Y-%m-%d').date()
+    try:
+        roast_date = _fast_iso_date(roast_date_str)
+    except (TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': 'Invalid roast_date'}), 400
 
     # Get roast level from the product
     roast_level = plan['roast_level'] or 'K'
@@ -1269,49 +1532,32 @@ def api_complete_plan_with_roast():
     else:
         lot_number = generate_roast_lot(roast_level, roast_date, product_id)
 
-    # Check if this LOT already exists (same product, same day, same level)
-    existing = query_db(
-        "SELECT id FROM roast_batches WHERE lot_number = ?",
-        (lot_number,), one=True
-    )
-
     conn = get_db()
     cur = conn.cursor()
 
     try:
-        if existing:
-            # Add to existing batch
-            cur.execute("""
-                UPDATE roast_batches
-                SET green_weight_g = green_weight_g + ?,
-                    roasted_weight_g = roasted_weight_g + ?,
-                    available_weight_g = available_weight_g + ?
-                WHERE lot_number = ?
-            """, (green_weight_g, roasted_weight_g, roasted_weight_g, lot_number))
-            batch_id = existing['id']
-        else:
-            # Calculate weight loss
-            weight_loss = ((green_weight_g - roasted_weight_g) / green_weight_g * 100) if green_weight_g > 0 else 0
+        cur.execute("BEGIN IMMEDIATE")
 
-            # Get day sequence from LOT number
-            day_seq = int(lot_number.split('/')[-1])
+        # Calculate weight loss
+        weight_loss = ((green_weight_g - roasted_weight_g) / green_weight_g * 100) if green_weight_g > 0 else 0
 
-            # Combine notes from plan and any additional notes
-            combined_notes = plan['notes'] or ''
-            if notes:
-                combined_notes = f"{combined_notes} | {notes}" if combined_notes else notes
+        # Get day sequence from LOT number
+        day_seq = int(lot_number.split('/')[-1])
 
-            # Insert new roast batch
-            cur.execute("""
-                INSERT INTO roast_batches (
-                    lot_number, product_id, roast_date, roast_level, day_sequence,
-                    green_weight_g, roasted_weight_g, available_weight_g, weight_loss_percent, notes
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                lot_number, product_id, roast_date.isoformat(), roast_level, day_seq,
-                green_weight_g, roasted_weight_g, roasted_weight_g, weight_loss, combined_notes
-            ))
-            batch_id = cur.lastrowid
+        # Combine notes from plan and any additional notes
+        combined_notes = plan['notes'] or ''
+        if notes:
+            combined_notes = f"{combined_notes} | {notes}" if combined_notes else notes
+
+        # Insert new roast batch, or add to the existing one if this LOT
+        # already exists (same product, same day, same level). Same upsert as
+        # new_roast; planned roasts have no RoastTime data.
+        batch_id = cur.execute(_SQL_UPSERT_ROAST_BATCH, (
+            lot_number, product_id, roast_date.isoformat(), roast_level, day_seq,
+            green_weight_g, roasted_weight_g, roasted_weight_g, weight_loss,
+            None, None, None, None, None,
+            None, None, None, None, combined_notes
+        )).fetchone()['id']
 
         # Mark plan as completed
         cur.execute("UPDATE roast_plans SET status = 'completed' WHERE id = ?", (plan_id,))
@@ -1364,56 +1610,72 @@ def api_analyze_orders():
     Roast calculation: 888g green -> ~750g roasted (15.5% loss)
     Each batch is a separate roast plan entry (not combined).
     """
-    import sys
-    sys.path.insert(0, '..')
-    from app import fetch_wc_orders
     import math
 
     # Fetch processing orders
     orders = fetch_wc_orders(status='processing')
 
-    # Get ALL products with their info
+    # Get ALL products with their info plus ROASTED inventory (in-stock
+    # weight, from product_stock) and PACKED inventory (available units *
+    # package size), in one query
     products = query_db("""
-        SELECT cp.id, cp.name, cp.roast_level, gc.country
+        SELECT cp.id, cp.name, cp.roast_level, gc.country,
+               COALESCE(pst.in_stock_g, 0) as roasted_g,
+               COALESCE(
+                   (SELECT SUM(pb.quantity * pb.package_size_g)
+                    FROM roast_batches rb
+                    JOIN production_sources ps ON rb.id = ps.roast_batch_id
+                    JOIN production_batches pb ON ps.production_batch_id = pb.id AND pb.quantity > 0
+                    WHERE rb.product_id = cp.id
+                   ), 0
+               ) as packed_g
         FROM coffee_products cp
         LEFT JOIN green_coffee gc ON cp.green_coffee_id = gc.id
+        LEFT JOIN product_stock pst ON pst.product_id = cp.id
         WHERE cp.is_active = 1
     """)
     products_by_id = {p['id']: p for p in products}
 
-    # Get ROASTED inventory (available weight in roast batches)
-    roasted_inventory = query_db("""
-        SELECT product_id, COALESCE(SUM(available_weight_g), 0) as roasted_g
-        FROM roast_batches
-        WHERE available_weight_g > 0
-        GROUP BY product_id
-    """)
-    roasted_by_product = {r['product_id']: r['roasted_g'] for r in roasted_inventory}
-
-    # Get PACKED inventory (available units * package size)
-    packed_inventory = query_db("""
-        SELECT cp.id as product_id,
-               COALESCE(SUM(pb.quantity * pb.package_size_g), 0) as packed_g
-        FROM coffee_products cp
-        LEFT JOIN roast_batches rb ON cp.id = rb.product_id
-        LEFT JOIN production_sources ps ON rb.id = ps.roast_batch_id
-        LEFT JOIN production_batches pb ON ps.production_batch_id = pb.id AND pb.quantity > 0
-        WHERE cp.is_active = 1
-        GROUP BY cp.id
-    """)
-    packed_by_product = {p['product_id']: p['packed_g'] for p in packed_inventory}
-
     # Get existing LOT assignments to subtract from needs
     # (already assigned = already fulfilled, don't need to roast for these)
     existing_assignments = query_db("""
-        SELECT wc_order_id, wc_order_item_id, slot_number, weight_g
+        SELECT CAST(wc_order_id AS TEXT) as wc_order_id, wc_order_item_id,
+               SUM(weight_g) as assigned_g
         FROM order_lot_assignments
+        GROUP BY 1, wc_order_item_id
     """)
     # Build a dict: (order_id, item_id) -> total_assigned_weight_g
-    assigned_by_item = {}
-    for a in existing_assignments:
-        key = (a['wc_order_id'], a['wc_order_item_id'])
-        assigned_by_item[key] = assigned_by_item.get(key, 0) + a['weight_g']
+    # (order IDs compared as text, like on the orders page)
+    assigned_by_item = {
+        (a['wc_order_id'], a['wc_order_item_id']): a['assigned_g']
+        for a in existing_assignments
+    }
+
+    # Product names lowercased once, longest first: the first name found in
+    # an order item is the best match (longer name matches are better; on a
+    # tie the stable sort keeps the earlier product, as before)
+    product_names = sorted(
+        ((p['name'].lower().strip(), p) for p in products if p['name'].strip()),
+        key=lambda np: len(np[0]), reverse=True
+    )
+    match_by_item_name = {}  # order item name -> best product (or None)
+
+    if ahocorasick is not None and product_names:
+        # One automaton over all names finds every name in an item in a single
+        # pass; the lowest rank (longest, then earliest product) wins
+        automaton = ahocorasick.Automaton()
+        for rank, (p_name, p) in enumerate(product_names):
+            if p_name not in automaton:
+                automaton.add_word(p_name, (rank, p))
+        automaton.make_automaton()
+
+        def best_product(item_name):
+            found = min((value for _, value in automaton.iter(item_name)),
+                        key=lambda value: value[0], default=None)
+            return found[1] if found else None
+    else:
+        def best_product(item_name):
+            return next((p for p_name, p in product_names if p_name in item_name), None)
 
     # Calculate needs from orders ONLY
     needs = {}  # product_id -> weight_needed_g
@@ -1425,23 +1687,14 @@ def api_analyze_orders():
             weight_per_unit = 500 if '500' in item['name'] else 250
 
             # Try to match product by NAME (strict matching)
-            best_match = None
-            best_match_score = 0
-
-            for p in products:
-                p_name = p['name'].lower().strip()
-
-                # Exact name match in order item (highest priority)
-                if p_name in item_name:
-                    score = len(p_name) * 10  # Longer name matches are better
-                    if score > best_match_score:
-                        best_match = p
-                        best_match_score = score
+            if item_name not in match_by_item_name:
+                match_by_item_name[item_name] = best_product(item_name)
+            best_match = match_by_item_name[item_name]
 
             if best_match:
                 total_weight_needed = item['quantity'] * weight_per_unit
                 # Subtract weight already assigned to this order item
-                already_assigned = assigned_by_item.get((order['id'], item['id']), 0)
+                already_assigned = assigned_by_item.get((str(order['id']), item['id']), 0)
                 weight_still_needed = max(0, total_weight_needed - already_assigned)
 
                 if weight_still_needed > 0:
@@ -1453,35 +1706,36 @@ def api_analyze_orders():
 
     suggestions = []
 
-    # Only check products that have been ordered
+    # Only check products that have been ordered (needs only holds matched,
+    # i.e. known, product ids)
     for product_id, needed_g in needs.items():
-        packed_g = packed_by_product.get(product_id, 0)
-        roasted_g = roasted_by_product.get(product_id, 0)
+        product = products_by_id[product_id]
+        packed_g = product['packed_g']
+        roasted_g = product['roasted_g']
         total_available_g = packed_g + roasted_g
 
         if needed_g > total_available_g:
             shortfall_g = needed_g - total_available_g
             # Calculate how many 888g batches needed to cover shortfall
             batches_needed = math.ceil(shortfall_g / ROASTED_OUTPUT_G)
-
-            product = products_by_id.get(product_id)
-            if product:
-                # Create SEPARATE suggestion for each batch (not combined)
-                for batch_num in range(1, batches_needed + 1):
-                    suggestions.append({
-                        'product_id': product_id,
-                        'product_name': product['name'],
-                        'needed_g': needed_g,
-                        'packed_g': int(packed_g),
-                        'roasted_g': int(roasted_g),
-                        'available_g': int(total_available_g),
-                        'shortfall_g': shortfall_g,
-                        'batch_number': batch_num,
-                        'total_batches': batches_needed,
-                        'suggested_roast_g': STANDARD_GREEN_WEIGHT_G,
-                        'expected_output_g': ROASTED_OUTPUT_G,
-                        'reason': 'order_need'
-                    })
+            packed_int, roasted_int, available_int = int(packed_g), int(roasted_g), int(total_available_g)
+
+            # Create SEPARATE suggestion for each batch (not combined)
+            for batch_num in range(1, batches_needed + 1):
+                suggestions.append({
+                    'product_id': product_id,
+                    'product_name': product['name'],
+                    'needed_g': needed_g,
+                    'packed_g': packed_int,
+                    'roasted_g': roasted_int,
+                    'available_g': available_int,
+                    'shortfall_g': shortfall_g,
+                    'batch_number': batch_num,
+                    'total_batches': batches_needed,
+                    'suggested_roast_g': STANDARD_GREEN_WEIGHT_G,
+                    'expected_output_g': ROASTED_OUTPUT_G,
+                    'reason': 'order_need'
+                })
 
     return jsonify({
         'status': 'success',
@@ -1495,23 +1749,38 @@ def api_analyze_orders():
 @tracker_login_required
 def api_refresh_order_statuses():
     """API: Fetch current WooCommerce order statuses"""
-    import sys
-    sys.path.insert(0, '..')
-    from app import wc_api_request
-
     order_ids = request.json.get('order_ids', [])
 
     if not order_ids:
         return jsonify({'status': 'error', 'message': 'No order IDs provided'}), 400
 
+    # Statuses are being checked for changes, so cached order lists may be stale
+    _wc_orders_cache.clear()
+
+    # One orders?include=... call per page of IDs instead of one request per order.
+    # Orders missing from the response (deleted, API error) are reported as 'unknown'.
+    requested = {str(order_id): order_id for order_id in order_ids}
+    ids = list(requested)
     statuses = {}
-    for order_id in order_ids:
+    for start in range(0, len(ids), WC_MAX_PER_PAGE):
+        chunk = ids[start:start + WC_MAX_PER_PAGE]
         try:
-            order_data = wc_api_request(f'orders/{order_id}')
-            if order_data:
-                statuses[order_id] = order_data.get('status', 'unknown')
+            orders_data = wc_api_request('orders', {
+                'include': ','.join(chunk),
+                'per_page': len(chunk),
+                # Only the status is needed, not the full order documents
+                '_fields': 'id,status',
+            })
         except Exception:
-            statuses[order_id] = 'unknown'
+            orders_data = None
+        if not orders_data:
+            continue
+        for order_data in orders_data:
+            order_id = requested.get(str(order_data.get('id')))
+            if order_id is not None:
+                statuses[order_id] = order_data.get('status', 'unknown')
+    for order_id in order_ids:
+        statuses.setdefault(order_id, 'unknown')
 
     return jsonify({
         'status': 'success',
@@ -1542,41 +1811,23 @@ def api_adjust_inventory():
     cur = conn.cursor()
 
     try:
+        cur.execute("BEGIN IMMEDIATE")
+
         # Get current total available for product
-        result = cur.execute("""
-            SELECT COALESCE(SUM(available_weight_g), 0) as total
-            FROM roast_batches WHERE product_id = ?
-        """, (product_id,)).fetchone()
-        previous_total = result['total'] if result else 0
+        previous_total = cur.execute(_SQL_PRODUCT_STOCK_TOTAL, (product_id,)).fetchone()['total']
 
         if batch_id:
-            # Adjust specific batch
-            batch = cur.execute("""
-                SELECT available_weight_g FROM roast_batches WHERE id = ? AND product_id = ?
-            """, (batch_id, product_id)).fetchone()
+            # Adjust specific batch; RETURNING tells whether it exists
+            batch = cur.execute(_SQL_ADJUST_BATCH_WEIGHT, (
+                adjustment_type, amount_g, amount_g, amount_g, batch_id, product_id
+            )).fetchone()
 
             if not batch:
+                conn.rollback()
                 return jsonify({'status': 'error', 'message': 'Batch not found'}), 404
 
-            current_batch_weight = batch['available_weight_g']
-
-            if adjustment_type == 'add':
-                new_batch_weight = current_batch_weight + amount_g
-            elif adjustment_type == 'subtract':
-                new_batch_weight = max(0, current_batch_weight - amount_g)
-            elif adjustment_type in ('set', 'correction'):
-                new_batch_weight = amount_g
-
-            cur.execute("""
-                UPDATE roast_batches SET available_weight_g = ? WHERE id = ?
-            """, (new_batch_weight, batch_id))
-
-            # Calculate new total
-            result = cur.execute("""
-                SELECT COALESCE(SUM(available_weight_g), 0) as total
-                FROM roast_batches WHERE product_id = ?
-            """, (product_id,)).fetchone()
-            new_total = result['total']
+            # Calculate new total (product_stock triggers already applied the update)
+            new_total = cur.execute(_SQL_PRODUCT_STOCK_TOTAL, (product_id,)).fetchone()['total']
 
         else:
             # Adjust product total - distribute across batches proportionally or use oldest first
@@ -1584,27 +1835,13 @@ def api_adjust_inventory():
             def create_adjustment_batch(weight_g):
                 from datetime import date
                 today = date.today()
-                # Generate a LOT number for the adjustment: ADJ-YYMMDD-N
-                lot_prefix = f"ADJ-{today.strftime('%y%m%d')}"
-                existing = cur.execute("""
-                    SELECT COUNT(*) as cnt FROM roast_batches
-                    WHERE lot_number LIKE ?
-                """, (f"{lot_prefix}%",)).fetchone()
-                seq = (existing['cnt'] or 0) + 1
-                lot_number = f"{lot_prefix}-{seq}"
-
-                # Get product's roast level
-                product = cur.execute("SELECT roast_level FROM coffee_products WHERE id = ?",
-                                     (product_id,)).fetchone()
-                roast_level = product['roast_level'] if product else 'K'
-
-                cur.execute("""
-                    INSERT INTO roast_batches
-                    (lot_number, product_id, roast_date, roast_level, day_sequence,
-                     green_weight_g, roasted_weight_g, available_weight_g, notes)
-                    VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?)
-                """, (lot_number, product_id, today.isoformat(), roast_level,
-                      weight_g, weight_g, weight_g, f"Manual inventory adjustment: {comment}"))
+                # LOT number for the adjustment: ADJ-YYMMDD-N, N = highest sequence today + 1
+                lot_prefix = f"ADJ-{today.strftime('%y%m%d')}-"
+                cur.execute(_SQL_INSERT_ADJUSTMENT_BATCH, (
+                    lot_prefix, len(lot_prefix) + 1, *lot_prefix_bounds(lot_prefix),
+                    product_id, today.isoformat(), product_id,
+                    weight_g, weight_g, weight_g, f"Manual inventory adjustment: {comment}"
+                ))
                 return cur.lastrowid
 
             if adjustment_type == 'add':
@@ -1625,22 +1862,8 @@ def api_adjust_inventory():
                 new_total = previous_total + amount_g
 
             elif adjustment_type == 'subtract':
-                # Subtract from oldest batches first (FIFO)
-                remaining = amount_g
-                batches = cur.execute("""
-                    SELECT id, available_weight_g FROM roast_batches
-                    WHERE product_id = ? AND available_weight_g > 0
-                    ORDER BY roast_date ASC
-                """, (product_id,)).fetchall()
-
-                for batch in batches:
-                    if remaining <= 0:
-                        break
-                    take = min(remaining, batch['available_weight_g'])
-                    new_weight = batch['available_weight_g'] - take
-                    cur.execute("UPDATE roast_batches SET available_weight_g = ? WHERE id = ?",
-                               (new_weight, batch['id']))
-                    remaining -= take
+                # Subtract from oldest batches first (FIFO), in one statement
+                cur.execute(_SQL_FIFO_SUBTRACT, (product_id, amount_g, amount_g))
 
                 new_total = max(0, previous_total - amount_g)
 
@@ -1708,6 +1931,8 @@ def api_adjust_batch_inventory():
     cur = conn.cursor()
 
     try:
+        cur.execute("BEGIN IMMEDIATE")
+
         # Get batch info
         batch = cur.execute("""
             SELECT rb.id, rb.product_id, rb.available_weight_g, rb.lot_number
@@ -1733,13 +1958,6 @@ def api_adjust_batch_inventory():
             UPDATE roast_batches SET available_weight_g = ? WHERE id = ?
         """, (new_weight, batch_id))
 
-        # Get product total for audit trail
-        result = cur.execute("""
-            SELECT COALESCE(SUM(available_weight_g), 0) as total
-            FROM roast_batches WHERE product_id = ?
-        """, (batch['product_id'],)).fetchone()
-        new_total = result['total']
-
         # Record the adjustment in audit log
         cur.execute("""
             INSERT INTO inventory_adjustments
@@ -1777,9 +1995,9 @@ def api_inventory_history(product_id):
         LIMIT 50
     """, (product_id,))
 
-    return jsonify({
+    return jsonify_fast({
         'status': 'success',
-        'adjustments': [dict(a) for a in adjustments]
+        'adjustments': adjustments
     })
 
 
@@ -1795,9 +2013,9 @@ def api_all_inventory_history():
         LIMIT 100
     """)
 
-    return jsonify({
+    return jsonify_fast({
         'status': 'success',
-        'adjustments': [dict(a) for a in adjustments]
+        'adjustments': adjustments
     })
 
 
@@ -1816,9 +2034,9 @@ def api_get_order_lot_assignments(order_id):
         ORDER BY ola.wc_order_item_id, ola.slot_number
     """, (str(order_id),))
 
-    return jsonify({
+    return jsonify_fast({
         'status': 'success',
-        'assignments': [dict(a) for a in assignments]
+        'assignments': assignments
     })
 
 
@@ -1839,90 +2057,58 @@ def api_assign_lot():
     cur = conn.cursor()
 
     try:
-        # Check if assignment already exists for this slot
-        existing = cur.execute("""
-            SELECT id, production_batch_id FROM order_lot_assignments
-            WHERE wc_order_id = ? AND wc_order_item_id = ? AND slot_number = ?
-        """, (order_id, order_item_id, slot_number)).fetchone()
+        cur.execute("BEGIN IMMEDIATE")
 
-        # Check production batch has enough stock (at least 1 unit)
+        # Production batch (with its source LOT) and the slot's current assignment
         batch = cur.execute("""
             SELECT pb.id, pb.production_lot, pb.quantity, pb.package_size_g,
-                   rb.id as roast_batch_id, rb.lot_number as source_lot
+                   rb.id as roast_batch_id, rb.lot_number as source_lot,
+                   (SELECT ola.production_batch_id FROM order_lot_assignments ola
+                    WHERE ola.wc_order_id = ? AND ola.wc_order_item_id = ? AND ola.slot_number = ?
+                   ) as existing_batch_id
             FROM production_batches pb
             JOIN production_sources ps ON pb.id = ps.production_batch_id
             JOIN roast_batches rb ON ps.roast_batch_id = rb.id
             WHERE pb.id = ?
-        """, (production_batch_id,)).fetchone()
+        """, (order_id, order_item_id, slot_number, production_batch_id)).fetchone()
 
         if not batch:
+            conn.rollback()
             return jsonify({'status': 'error', 'message': 'Production batch not found'}), 404
 
-        if existing:
-            # If changing to a different batch, restore stock to old batch first
-            if existing['production_batch_id'] != production_batch_id:
-                # Restore stock to old batch (add 1 unit back)
-                cur.execute("""
-                    UPDATE production_batches
-                    SET quantity = quantity + 1
-                    WHERE id = ?
-                """, (existing['production_batch_id'],))
-
-                # Check new batch has enough stock
-                if batch['quantity'] < 1:
-                    conn.rollback()
-                    return jsonify({
-                        'status': 'error',
-                        'message': f'No stock available. Remaining: {batch["quantity"]} units'
-                    }), 400
-
-                # Deduct from new batch (remove 1 unit)
-                cur.execute("""
-                    UPDATE production_batches
-                    SET quantity = quantity - 1
-                    WHERE id = ?
-                """, (production_batch_id,))
-
-            # Update existing assignment
-            cur.execute("""
-                UPDATE order_lot_assignments
-                SET production_batch_id = ?, roast_batch_id = ?, weight_g = ?, assigned_at = CURRENT_TIMESTAMP
-                WHERE id = ?
-            """, (production_batch_id, batch['roast_batch_id'], batch['package_size_g'], existing['id']))
-        else:
-            # New assignment - check stock and deduct
-            if batch['quantity'] < 1:
+        existing_batch_id = batch['existing_batch_id']
+        production_lot = batch['production_lot']
+        remaining_quantity = batch['quantity']
+
+        # Re-assigning the same batch leaves stock alone; otherwise move one unit
+        if existing_batch_id != production_batch_id:
+            if remaining_quantity < 1:
+                conn.rollback()
                 return jsonify({
                     'status': 'error',
-                    'message': f'No stock available. Remaining: {batch["quantity"]} units'
+                    'message': f'No stock available. Remaining: {remaining_quantity} units'
                 }), 400
 
-            # Deduct stock (remove 1 unit from production batch)
-            cur.execute("""
-                UPDATE production_batches
-                SET quantity = quantity - 1
-                WHERE id = ?
-            """, (production_batch_id,))
+            if existing_batch_id is not None:
+                # Restore stock to old batch (add 1 unit back)
+                cur.execute(_SQL_RESTORE_PRODUCTION_UNIT, (existing_batch_id,))
 
-            # Create new assignment
-            cur.execute("""
-                INSERT INTO order_lot_assignments
-                (wc_order_id, wc_order_item_id, slot_number, production_batch_id, roast_batch_id, weight_g)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (order_id, order_item_id, slot_number, production_batch_id, batch['roast_batch_id'], batch['package_size_g']))
+            # Deduct from new batch (remove 1 unit)
+            production_lot, remaining_quantity = cur.execute(
+                _SQL_DEDUCT_PRODUCTION_UNIT, (production_batch_id,)).fetchone()
 
-        conn.commit()
+        cur.execute(_SQL_UPSERT_LOT_ASSIGNMENT, (
+            order_id, order_item_id, slot_number, production_batch_id,
+            batch['roast_batch_id'], batch['package_size_g']
+        ))
 
-        # Get updated quantity for response
-        updated_batch = cur.execute("""
-            SELECT production_lot, quantity FROM production_batches WHERE id = ?
-        """, (production_batch_id,)).fetchone()
+        conn.commit()
 
         return jsonify({
             'status': 'success',
             'lot_number': batch['source_lot'],
-            'production_lot': updated_batch['production_lot'] if updated_batch else None,
-            'remaining_quantity': updated_batch['quantity'] if updated_batch else 0
+            'production_lot': production_lot,
+            'remaining_quantity': remaining_quantity
         })
 
     except Exception as e:
@@ -1948,6 +2134,8 @@ def api_remove_lot_assignment():
     cur = conn.cursor()
 
     try:
+        cur.execute("BEGIN IMMEDIATE")
+
         # Get the existing assignment to restore stock
         existing = cur.execute("""
             SELECT production_batch_id FROM order_lot_assignments
@@ -1968,7 +2156,7 @@ def api_remove_lot_assignment():
                 WHERE wc_order_id = ? AND wc_order_item_id = ? AND slot_number = ?
             """, (order_id, order_item_id, slot_number))
 
-            conn.commit()
+        conn.commit()
 
         return jsonify({'status': 'success'})
 
@@ -1983,19 +2171,18 @@ def api_remove_lot_assignment():
 @tracker_login_required
 def api_available_lots():
     """Get all available LOTs for assignment (unpacked roasted coffee)"""
-    lots = query_db("""
-        SELECT rb.id, rb.lot_number, rb.available_weight_g, rb.roast_date,
-               cp.id as product_id, cp.name as product_name, cp.roast_level, gc.country
-        FROM roast_batches rb
-        JOIN coffee_products cp ON rb.product_id = cp.id
-        LEFT JOIN green_coffee gc ON cp.green_coffee_id = gc.id
-        WHERE rb.available_weight_g > 0
-        ORDER BY cp.name, rb.roast_date DESC
-    """)
-
-    return jsonify({
+    # Polled on every drag/drop in the assignment UI; cached until stock changes
+    return _stock_cached_json('available_lots', lambda: {
         'status': 'success',
-        'lots': [dict(l) for l in lots]
+        'lots': query_db("""
+            SELECT rb.id, rb.lot_number, rb.available_weight_g, rb.roast_date,
+                   cp.id as product_id, cp.name as product_name, cp.roast_level, gc.country
+            FROM roast_batches rb
+            JOIN coffee_products cp ON rb.product_id = cp.id
+            LEFT JOIN green_coffee gc ON cp.green_coffee_id = gc.id
+            WHERE rb.available_weight_g > 0
+            ORDER BY cp.name, rb.roast_date DESC
+        """)
     })
 
 
@@ -2003,7 +2190,7 @@ def api_available_lots():
 @tracker_login_required
 def api_available_packed_lots():
     """Get all available PACKED LOTs for order assignment (only packaged products can be shipped)"""
-    lots = query_db("""
+    lots = query_db(f"""
         SELECT pb.id as production_batch_id, pb.production_lot, pb.production_type,
                pb.package_size_g, pb.quantity as available_quantity,
                rb.id as roast_batch_id, rb.lot_number as source_lot, rb.roast_date,
@@ -2014,13 +2201,13 @@ def api_available_packed_lots():
         JOIN coffee_products cp ON rb.product_id = cp.id
         LEFT JOIN green_coffee gc ON cp.green_coffee_id = gc.id
         WHERE pb.quantity > 0
-          AND pb.production_type IN ('whole_bean_250', 'whole_bean_70', 'whole_bean_16', 'drip_11')
+          AND pb.production_type IN ({PACKED_TYPES_SQL})
         ORDER BY cp.name, pb.package_size_g DESC, pb.production_date DESC
     """)
 
-    return jsonify({
+    return jsonify_fast({
         'status': 'success',
-        'lots': [dict(l) for l in lots]
+        'lots': lots
     })
 
 
@@ -2227,13 +2414,18 @@ def b2b_order_new():
             flash('Please select a customer', 'error')
             return redirect(url_for('roast_tracker.b2b_order_new'))
 
+        try:
+            parsed_order_date = _fast_iso_date(order_date)
+        except (TypeError, ValueError):
+            flash('Invalid order date', 'error')
+            return redirect(url_for('roast_tracker.b2b_order_new'))
+
         # Get customer's payment terms for due date
         customer = query_db("SELECT payment_terms_days FROM b2b_customers WHERE id = ?",
                             (customer_id,), one=True)
         payment_terms = customer['payment_terms_days'] if customer else 14
 
-        order_dt = datetime.strptime(order_date, '%Y-%m-%d')
-        due_date = (order_dt + timedelta(days=payment_terms)).strftime('%Y-%m-%d')
+        due_date = (parsed_order_date + timedelta(days=payment_terms)).isoformat()
 
         conn = get_db()
         cur = conn.cursor()
@@ -2297,7 +2489,7 @@ def b2b_order_detail(order_id):
     """)
 
     # Combine products: POS items first, then roast tracker coffee products
-    products = list(pos_products) + [dict(p) for p in roast_tracker_products]
+    products = pos_products + roast_tracker_products
 
     # Get customer's product discounts
     customer_discounts = query_db("""
@@ -2504,9 +2696,8 @@ def b2b_order_generate_invoice(order_id):
     import json
 
     # Get Billingo settings from app config
-    import sys
-    sys.path.insert(0, '..')
-    from app import BILLINGO_API_KEY, BILLINGO_BASE_URL, BILLINGO_INVOICE_BLOCK_ID
+    BILLINGO_API_KEY, BILLINGO_BASE_URL, BILLINGO_INVOICE_BLOCK_ID = _app_settings(
+        'BILLINGO_API_KEY', 'BILLINGO_BASE_URL', 'BILLINGO_INVOICE_BLOCK_ID')
 
     # Get order with customer details
     order = query_db("""
@@ -2643,9 +2834,8 @@ def b2b_order_generate_partial_invoice(order_id):
     import requests
     import json
 
-    import sys
-    sys.path.insert(0, '..')
-    from app import BILLINGO_API_KEY, BILLINGO_BASE_URL, BILLINGO_INVOICE_BLOCK_ID
+    BILLINGO_API_KEY, BILLINGO_BASE_URL, BILLINGO_INVOICE_BLOCK_ID = _app_settings(
+        'BILLINGO_API_KEY', 'BILLINGO_BASE_URL', 'BILLINGO_INVOICE_BLOCK_ID')
 
     # Get order with customer details
     order = query_db("""
@@ -2856,9 +3046,7 @@ def b2b_download_invoice_by_id(document_id):
     import io
     from flask import send_file
 
-    import sys
-    sys.path.insert(0, '..')
-    from app import BILLINGO_API_KEY, BILLINGO_BASE_URL
+    BILLINGO_API_KEY, BILLINGO_BASE_URL = _app_settings('BILLINGO_API_KEY', 'BILLINGO_BASE_URL')
 
     headers = {"X-API-KEY": BILLINGO_API_KEY}
 
@@ -2883,9 +3071,7 @@ def b2b_cancel_invoice_by_id(order_id, document_id):
     """Cancel/Sztornó a specific invoice by document ID"""
     import requests
 
-    import sys
-    sys.path.insert(0, '..')
-    from app import BILLINGO_API_KEY, BILLINGO_BASE_URL
+    BILLINGO_API_KEY, BILLINGO_BASE_URL = _app_settings('BILLINGO_API_KEY', 'BILLINGO_BASE_URL')
 
     cancellation_reason = request.form.get('cancellation_reason', 'Cancelled')
 
@@ -2947,9 +3133,7 @@ def b2b_order_download_invoice(order_id):
     import io
     from flask import send_file
 
-    import sys
-    sys.path.insert(0, '..')
-    from app import BILLINGO_API_KEY, BILLINGO_BASE_URL
+    BILLINGO_API_KEY, BILLINGO_BASE_URL = _app_settings('BILLINGO_API_KEY', 'BILLINGO_BASE_URL')
 
     order = query_db("SELECT billingo_document_id FROM b2b_orders WHERE id = ?", (order_id,), one=True)
 
@@ -2987,9 +3171,7 @@ def b2b_order_cancel_invoice(order_id):
     """Cancel/Sztornó invoice for B2B order"""
     import requests
 
-    import sys
-    sys.path.insert(0, '..')
-    from app import BILLINGO_API_KEY, BILLINGO_BASE_URL
+    BILLINGO_API_KEY, BILLINGO_BASE_URL = _app_settings('BILLINGO_API_KEY', 'BILLINGO_BASE_URL')
 
     cancellation_reason = request.form.get('cancellation_reason', 'Sztornó')
 
@@ -3036,9 +3218,8 @@ def wc_generate_invoice(order_id):
     import requests
     from datetime import date
 
-    import sys
-    sys.path.insert(0, '..')
-    from app import BILLINGO_API_KEY, BILLINGO_BASE_URL, BILLINGO_INVOICE_BLOCK_ID, fetch_wc_orders
+    BILLINGO_API_KEY, BILLINGO_BASE_URL, BILLINGO_INVOICE_BLOCK_ID = _app_settings(
+        'BILLINGO_API_KEY', 'BILLINGO_BASE_URL', 'BILLINGO_INVOICE_BLOCK_ID')
 
     # Check if invoice already exists
     existing = query_db("SELECT billingo_document_id FROM wc_order_invoices WHERE wc_order_id = ?",
@@ -3047,13 +3228,13 @@ def wc_generate_invoice(order_id):
         flash(f'Invoice already exists: #{existing["billingo_document_id"]}', 'info')
         return redirect(url_for('roast_tracker.orders'))
 
-    # Fetch the order from WooCommerce
-    orders = fetch_wc_orders(status='processing')
+    # Fetch the order from WooCommerce (uncached: the invoice must match the live order)
+    orders = _app().fetch_wc_orders(status='processing')
     order = next((o for o in orders if o['id'] == order_id), None)
 
     if not order:
         # Try completed orders too
-        orders = fetch_wc_orders(status='completed')
+        orders = _app().fetch_wc_orders(status='completed')
         order = next((o for o in orders if o['id'] == order_id), None)
 
     if not order:
@@ -3189,9 +3370,7 @@ def wc_download_invoice(order_id):
     import io
     from flask import send_file
 
-    import sys
-    sys.path.insert(0, '..')
-    from app import BILLINGO_API_KEY, BILLINGO_BASE_URL
+    BILLINGO_API_KEY, BILLINGO_BASE_URL = _app_settings('BILLINGO_API_KEY', 'BILLINGO_BASE_URL')
 
     invoice = query_db("SELECT billingo_document_id FROM wc_order_invoices WHERE wc_order_id = ?",
                        (order_id,), one=True)
@@ -3228,7 +3407,7 @@ def api_b2b_customers():
         WHERE is_active = 1
         ORDER BY company_name
     """)
-    return jsonify({'status': 'success', 'customers': [dict(c) for c in customers]})
+    return jsonify_fast({'status': 'success', 'customers': customers})
 
 
 @roast_tracker.route('/api/b2b/customer/<int:customer_id>/discounts')
@@ -3250,11 +3429,17 @@ def api_b2b_customer_discounts(customer_id):
     })
 
 
-# Initialize database on first request
-@roast_tracker.before_app_request
-def ensure_db():
-    """Ensure database exists"""
-    from .database import DATABASE_PATH
-    import os
-    if not os.path.exists(DATABASE_PATH):
-        init_db()
+# Initialize the database once, when app.py registers the blueprint at startup.
+# init_db is idempotent (CREATE IF NOT EXISTS + guarded migrations) and also
+# creates newer tables, indexes and triggers, so it runs even when the database
+# file exists. Requests no longer go through a before_app_request hook.
+@roast_tracker.record_once
+def ensure_db(state):
+    """Ensure database exists and its schema is current"""
+    init_db()
+
+
+@roast_tracker.teardown_app_request
+def release_db(exc):
+    """Don't let an aborted request's transaction leak into the next one on this thread"""
+    release_thread_db()